@@ -0,0 +1,178 @@
+"""Local stand-in for the Aigues de Barcelona API, for benchmarks.
+
+Serves synthetic contracts, invoices and HOURLY/DAILY consumptions for any
+date range, with configurable latency, payload size and bursts of 429.
+
+    python benchmarks/mock_server.py --port 8080 --latency 0.05
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import json
+import time
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+
+from aiohttp import web
+
+API_COOKIE_TOKEN = "ofexTokenJwt"
+CONTRACTS = ["BENCH1", "BENCH2"]
+TZ = timezone(timedelta(hours=1))
+
+
+def make_token(user: str = "12345678Z", expires_in: int = 86400) -> str:
+    """Unsigned JWT with the claims used by the client."""
+    claims = {"name": user, "exp": int(time.time()) + expires_in}
+    payload = base64.urlsafe_b64encode(json.dumps(claims).encode()).decode()
+    return f"bench.{payload.rstrip('=')}.bench"
+
+
+class MockAiguesApi:
+    """aiohttp application answering like the API.
+
+    - latency: seconds to wait before each response.
+    - burst_every / burst_size: after every `burst_every` requests, answer
+      the next `burst_size` with 429 and Retry-After.
+    - padding: bytes of filler added to every reading, to grow payloads.
+    - max_days: longest date range accepted, longer ones get 400.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        burst_every: int = 0,
+        burst_size: int = 0,
+        retry_after: float = 0,
+        padding: int = 0,
+        max_days: int = 0,
+    ) -> None:
+        self.latency = latency
+        self.burst_every = burst_every
+        self.burst_size = burst_size
+        self.retry_after = retry_after
+        self.padding = "x" * padding
+        self.max_days = max_days
+        self.requests = 0
+        self.rate_limited = 0
+        self.rows = 0
+
+        self.app = web.Application(middlewares=[self._middleware])
+        self.app.router.add_post("/ofex-login-api/auth/getToken", self.login)
+        self.app.router.add_get("/ofex-contracts-api/contracts", self.contracts)
+        self.app.router.add_get("/ofex-invoices-api/invoices", self.invoices)
+        self.app.router.add_get(
+            "/ofex-water-consumptions-api/meter/consumptions", self.consumptions
+        )
+
+    @web.middleware
+    async def _middleware(self, request, handler):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        cycle = self.burst_every + self.burst_size
+        if self.burst_size and self.requests % cycle >= self.burst_every:
+            self.rate_limited += 1
+            return web.json_response(
+                {"message": "Rate limit is exceeded"},
+                status=429,
+                headers={"Retry-After": str(self.retry_after)},
+            )
+        return await handler(request)
+
+    async def login(self, request):
+        token = make_token()
+        resp = web.json_response({"access_token": token})
+        resp.set_cookie(API_COOKIE_TOKEN, token)
+        return resp
+
+    async def contracts(self, request):
+        return web.json_response(
+            {"data": [{"contractDetail": {"contractNumber": x}} for x in CONTRACTS]}
+        )
+
+    async def invoices(self, request):
+        months = int(request.query.get("lastMonths", 36))
+        debt = request.query.get("mode") == "DEBT"
+        today = datetime.now(TZ).date()
+        data = list()
+        for idx in range(0 if debt else max(months // 2, 1)):
+            issued = today - timedelta(days=61 * idx)
+            data.append(
+                {
+                    "invoiceNumber": f"F{issued:%Y%m}",
+                    "invoiceDate": issued.isoformat(),
+                    "totalAmount": 40.0 + idx % 5,
+                    "consumption": 18 + idx % 4,
+                }
+            )
+        return web.json_response({"data": data})
+
+    @staticmethod
+    def _value(when: datetime) -> float:
+        # deterministic accumulated meter value, about 4 L per hour
+        return round(when.timestamp() / 3600 * 0.004 % 100000, 4)
+
+    async def consumptions(self, request):
+        date_from = datetime.strptime(request.query["fromDate"], "%d-%m-%Y")
+        date_to = datetime.strptime(request.query["toDate"], "%d-%m-%Y")
+        if self.max_days and (date_to - date_from).days >= self.max_days:
+            return web.json_response({"message": "Date range too long"}, status=400)
+        step = timedelta(hours=1)
+        if request.query.get("consumptionFrequency") == "DAILY":
+            step = timedelta(days=1)
+        now = datetime.now(TZ) - timedelta(days=1)
+        current = date_from.replace(tzinfo=TZ)
+        end = min((date_to + timedelta(days=1)).replace(tzinfo=TZ), now)
+
+        data = list()
+        while current < end:
+            item = {
+                "datetime": current.isoformat(),
+                "accumulatedConsumption": self._value(current),
+            }
+            if self.padding:
+                item["padding"] = self.padding
+            data.append(item)
+            current += step
+        self.rows += len(data)
+        return web.json_response({"message": "ok", "data": data})
+
+
+async def serve(api: MockAiguesApi, port: int = 0) -> tuple[web.AppRunner, str]:
+    """Start the server, return the runner and its base URL."""
+    runner = web.AppRunner(api.app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--burst-every", type=int, default=0)
+    parser.add_argument("--burst-size", type=int, default=0)
+    parser.add_argument("--retry-after", type=float, default=0)
+    parser.add_argument("--padding", type=int, default=0)
+    parser.add_argument("--max-days", type=int, default=0)
+    args = parser.parse_args()
+
+    api = MockAiguesApi(
+        args.latency,
+        args.burst_every,
+        args.burst_size,
+        args.retry_after,
+        args.padding,
+        args.max_days,
+    )
+    web.run_app(api.app, host="127.0.0.1", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
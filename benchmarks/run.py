@@ -0,0 +1,285 @@
+"""Benchmarks of the poll and backfill paths against the mock API.
+
+    python benchmarks/run.py
+    python benchmarks/run.py --latency 0.05 --years 1 3 5 --save baseline.json
+    python benchmarks/run.py --compare baseline.json --tolerance 0.2
+
+Measures the API client throughput, the statistics import time per 10k
+rows (with a SQLite recorder), the backfill wall-clock time and the peak
+memory of each of them. Times are taken from untraced runs, and the peak
+memory from a second, traced run. With --compare, exits with an error if
+any time is worse than the baseline by more than the tolerance.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from datetime import timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from mock_server import make_token  # noqa: E402
+from mock_server import MockAiguesApi  # noqa: E402
+from mock_server import serve  # noqa: E402
+from mock_server import TZ  # noqa: E402
+
+from custom_components.aigues_barcelona.api import AsyncAiguesApiClient  # noqa: E402
+from custom_components.aigues_barcelona.backfill import BackfillEngine  # noqa: E402
+from custom_components.aigues_barcelona.const import DOMAIN  # noqa: E402
+from custom_components.aigues_barcelona.transport import TokenBucket  # noqa: E402
+
+CONTRACT = "BENCH1"
+
+
+class measure:
+    """Wall-clock time of a block, and its peak memory if `traced`.
+
+    Tracing allocations slows the code down several times, so times of a
+    traced block are not meaningful.
+    """
+
+    def __init__(self, traced: bool = False):
+        self.traced = traced
+        self.peak_mb = None
+
+    def __enter__(self):
+        if self.traced:
+            tracemalloc.start()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.seconds = time.perf_counter() - self.start
+        if self.traced:
+            self.peak_mb = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+            tracemalloc.stop()
+
+
+async def timed_and_traced(bench, *args, memory: bool = True) -> dict:
+    """Results of an untraced run, with the peak memory of a traced one."""
+    results = await bench(*args, traced=False)
+    if memory:
+        results["peak_mb"] = (await bench(*args, traced=True))["peak_mb"]
+    return results
+
+
+def make_client(base_url: str, rate_limit: bool) -> AsyncAiguesApiClient:
+    client = AsyncAiguesApiClient("12345678Z", "bench")
+    client.api_host = base_url
+    client.set_token(make_token())
+    if not rate_limit:
+        # measure the client, not the host limiter
+        client._limiter = TokenBucket(rate=1e9, capacity=1e9)
+    return client
+
+
+def synthetic_rows(count: int) -> list[dict]:
+    start = datetime.now(TZ).replace(minute=0, second=0, microsecond=0)
+    start -= timedelta(hours=count + 24)
+    return [
+        {
+            "datetime": (start + timedelta(hours=idx)).isoformat(),
+            "accumulatedConsumption": round(100 + idx * 0.0041, 4),
+        }
+        for idx in range(count)
+    ]
+
+
+async def bench_client(base_url: str, args, traced: bool = False) -> dict:
+    """Concurrent one week HOURLY requests."""
+    client = make_client(base_url, args.rate_limit)
+    today = datetime.now()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def fetch(idx: int) -> int:
+        date_to = today - timedelta(days=7 * idx)
+        async with semaphore:
+            rows = await client.consumptions(
+                date_to - timedelta(days=6), date_to, CONTRACT
+            )
+        return len(rows)
+
+    with measure(traced) as result:
+        rows = sum(await asyncio.gather(*[fetch(x) for x in range(args.requests)]))
+    await client.close()
+    return {
+        "seconds": result.seconds,
+        "requests_per_second": args.requests / result.seconds,
+        "rows_per_second": rows / result.seconds,
+        "peak_mb": result.peak_mb,
+    }
+
+
+async def bench_backfill(base_url: str, years: int, args, traced: bool = False) -> dict:
+    client = make_client(base_url, args.rate_limit)
+    today = datetime.now()
+    engine = BackfillEngine(client, CONTRACT)
+    with measure(traced) as result:
+        rows = await engine.run(today - timedelta(days=365 * years), today)
+    await client.close()
+    return {
+        "seconds": result.seconds,
+        "rows": len(rows),
+        "failed_windows": len(engine.failed),
+        "requests": client.metrics.histogram("request.consumptions").count,
+        "peak_mb": result.peak_mb,
+    }
+
+
+async def bench_import(rows: int, traced: bool = False) -> dict:
+    """Import statistics through a ContratoAgua with a SQLite recorder."""
+    from homeassistant import config_entries
+    from homeassistant import loader
+    from homeassistant.components.recorder import get_instance
+    from homeassistant.core import HomeAssistant
+    from homeassistant.helpers import entity
+    from homeassistant.helpers import recorder
+    from homeassistant.helpers import translation
+    from homeassistant.setup import async_setup_component
+
+    from custom_components.aigues_barcelona.coordinator import ContratoAgua
+
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass = HomeAssistant(config_dir)
+        # what bootstrap does before setting up the recorder, where it exists
+        for helper in (entity, loader, translation):
+            if hasattr(helper, "async_setup"):
+                helper.async_setup(hass)
+        hass.config_entries = config_entries.ConfigEntries(hass, {})
+        await hass.config_entries.async_initialize()
+        if hasattr(recorder, "async_initialize_recorder"):
+            recorder.async_initialize_recorder(hass)
+        db_url = f"sqlite:///{config_dir}/bench.db"
+        assert await async_setup_component(
+            hass, "recorder", {"recorder": {"db_url": db_url, "commit_interval": 0}}
+        )
+        await hass.async_start()
+        await get_instance(hass).async_db_ready
+        hass.data.setdefault(DOMAIN, {})
+
+        client = AsyncAiguesApiClient("12345678Z", "bench")
+        contrato = ContratoAgua(hass, client, CONTRACT)
+        consumptions = synthetic_rows(rows)
+        with measure(traced) as result:
+            await contrato._async_import_statistics(consumptions)
+            await get_instance(hass).async_block_till_done()
+
+        await hass.async_stop()
+        await client.close()
+
+    return {
+        "seconds": result.seconds,
+        "seconds_per_10k_rows": result.seconds / rows * 10000,
+        "peak_mb": result.peak_mb,
+    }
+
+
+async def run(args) -> dict:
+    api = MockAiguesApi(
+        args.latency,
+        args.burst_every,
+        args.burst_size,
+        args.retry_after,
+        args.padding,
+        args.max_days,
+    )
+    runner, base_url = await serve(api)
+    results = dict()
+    try:
+        results["client"] = await timed_and_traced(
+            bench_client, base_url, args, memory=args.memory
+        )
+        for years in args.years:
+            results[f"backfill_{years}y"] = await timed_and_traced(
+                bench_backfill, base_url, years, args, memory=args.memory
+            )
+    finally:
+        await runner.cleanup()
+
+    if not args.skip_import:
+        results["import"] = await timed_and_traced(
+            bench_import, args.rows, memory=args.memory
+        )
+    results["server"] = {"requests": api.requests, "rate_limited": api.rate_limited}
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Benchmarks whose time got worse than the baseline."""
+    regressions = list()
+    for name, values in results.items():
+        before = baseline.get(name, {}).get("seconds")
+        if before and values.get("seconds", 0) > before * (1 + tolerance):
+            regressions.append(
+                f"{name}: {values['seconds']:.3f}s, baseline {before:.3f}s"
+            )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--padding", type=int, default=0)
+    parser.add_argument(
+        "--max-days", type=int, default=0, help="longest range accepted by the API"
+    )
+    parser.add_argument("--burst-every", type=int, default=0)
+    parser.add_argument("--burst-size", type=int, default=0)
+    parser.add_argument("--retry-after", type=float, default=0)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--years", type=int, nargs="*", default=[1, 3, 5])
+    parser.add_argument(
+        "--rate-limit", action="store_true", help="keep the host rate limit"
+    )
+    parser.add_argument("--skip-import", action="store_true")
+    parser.add_argument(
+        "--no-memory",
+        dest="memory",
+        action="store_false",
+        help="skip the traced runs measuring the peak memory",
+    )
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    results = asyncio.run(run(args))
+
+    for name, values in results.items():
+        print(
+            f"{name:14}",
+            "  ".join(
+                f"{k}={v:.3f}" if isinstance(v, float) else f"{k}={v}"
+                for k, v in values.items()
+            ),
+        )
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,56 +2,141 @@
 
 from __future__ import annotations
 
+import logging
+from datetime import timedelta
+
+import aiohttp
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.config_entries import SOURCE_REAUTH
 from homeassistant.const import CONF_PASSWORD
 from homeassistant.const import CONF_TOKEN
 from homeassistant.const import CONF_USERNAME
 from homeassistant.const import Platform
+from homeassistant.core import callback
 from homeassistant.core import HomeAssistant
-from homeassistant.exceptions import ConfigEntryAuthFailed
+from homeassistant.helpers.aiohttp_client import async_create_clientsession
+from homeassistant.helpers.event import async_track_point_in_utc_time
 
-from .api import AiguesApiClient
+from .api import AsyncAiguesApiClient
+from .api import TokenManager
+from .cache import ConsumptionCache
 from .const import DOMAIN
+from .const import TOKEN_REFRESH_MARGIN
+from .coordinator import async_save_token
+from .coordinator import async_schedule_first_refresh
+from .coordinator import async_setup_coordinators
+from .coordinator import async_setup_invoices
+from .jobs import async_setup_jobs
 from .service import async_setup as setup_service
 
 # from homeassistant.exceptions import ConfigEntryNotReady
 
-PLATFORMS = [Platform.SENSOR]
+PLATFORMS = [Platform.SENSOR, Platform.BINARY_SENSOR]
+
+_LOGGER = logging.getLogger(__name__)
 
 
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
 
     # TODO Change after fixing Recaptcha.
-    api = AiguesApiClient(entry.data[CONF_USERNAME], entry.data[CONF_PASSWORD])
-    api.set_token(entry.data.get(CONF_TOKEN))
-
-    if api.is_token_expired():
+    # check before creating the session, it is not closed if setup fails
+    if TokenManager(entry.data.get(CONF_TOKEN)).is_expired():
         await hass.config_entries.flow.async_init(
             DOMAIN,
             context={"source": SOURCE_REAUTH},
             data=entry,
         )
         return False
-        raise ConfigEntryAuthFailed
+
+    # one client (session, connection pool and token) shared by all contracts
+    api = AsyncAiguesApiClient(
+        entry.data[CONF_USERNAME],
+        entry.data[CONF_PASSWORD],
+        session=async_create_clientsession(hass, cookie_jar=aiohttp.DummyCookieJar()),
+    )
+    api.set_token(entry.data.get(CONF_TOKEN))
 
     # try:
-    #    await hass.async_add_executor_job(api.login)
+    #    await api.login()
     # except:
     #    raise ConfigEntryNotReady
 
+    api.cache = ConsumptionCache(hass, entry.entry_id)
+    await api.cache.async_load()
+
+    hass.data.setdefault(DOMAIN, {})[entry.entry_id] = {
+        "api": api,
+        "options": dict(entry.options),
+    }
+    hass.data[DOMAIN][entry.entry_id]["account"] = await async_setup_coordinators(
+        hass, entry, api
+    )
+    hass.data[DOMAIN][entry.entry_id]["invoices"] = await async_setup_invoices(
+        hass, entry, api
+    )
+    hass.data[DOMAIN][entry.entry_id]["jobs"] = await async_setup_jobs(
+        hass, entry, api, hass.data[DOMAIN][entry.entry_id]["account"]
+    )
+    # once the history can be imported by a job
+    async_schedule_first_refresh(hass, hass.data[DOMAIN][entry.entry_id]["account"])
+
     await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
+    entry.async_on_unload(entry.add_update_listener(async_reload_entry))
 
     await setup_service(hass, entry)
 
+    async_schedule_token_refresh(hass, entry, api)
+
     return True
 
 
+@callback
+def async_schedule_token_refresh(
+    hass: HomeAssistant, entry: ConfigEntry, api: AsyncAiguesApiClient
+) -> None:
+    """Login again before the token expires, or ask for a new one."""
+    expires = api.token.expires_at
+    if expires is None:
+        return
+
+    async def _async_token_expiring(now) -> None:
+        _LOGGER.info("Token is about to expire, trying to login again")
+        if await api.relogin() and not api.is_token_expired(TOKEN_REFRESH_MARGIN):
+            async_save_token(hass, entry.entry_id, api)
+            async_schedule_token_refresh(hass, entry, api)
+            return
+
+        await hass.config_entries.flow.async_init(
+            DOMAIN,
+            context={"source": SOURCE_REAUTH},
+            data=entry,
+        )
+
+    entry.async_on_unload(
+        async_track_point_in_utc_time(
+            hass,
+            _async_token_expiring,
+            expires - timedelta(seconds=TOKEN_REFRESH_MARGIN),
+        )
+    )
+
+
+async def async_reload_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Reload entry after options have changed."""
+    # the entry is also updated when a new token is saved
+    data = hass.data.get(DOMAIN, {}).get(entry.entry_id)
+    if data is not None and data["options"] == dict(entry.options):
+        return
+    await hass.config_entries.async_reload(entry.entry_id)
+
+
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     unload_ok = await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
     if unload_ok:
         if entry.entry_id in hass.data[DOMAIN].keys():
-            hass.data[DOMAIN].pop(entry.entry_id)
+            data = hass.data[DOMAIN].pop(entry.entry_id)
+            # session created for this entry, connector is shared with HA
+            await data["api"].cli.close()
     if not hass.data[DOMAIN]:
         del hass.data[DOMAIN]
 
@@ -0,0 +1,136 @@
+"""Leak and anomaly detection over the hourly readings."""
+
+from __future__ import annotations
+
+import math
+from datetime import datetime
+from datetime import timedelta
+
+from .const import LEAK_CONTINUOUS_HOURS
+from .const import LEAK_EWMA_ALPHA
+from .const import LEAK_MIN_SAMPLES
+from .const import LEAK_NIGHT_END
+from .const import LEAK_NIGHT_FLOW
+from .const import LEAK_NIGHT_START
+from .const import LEAK_ZSCORE
+
+PROBLEMS = ("night_leak", "continuous_flow", "anomaly")
+
+
+class LeakDetector:
+    """Streaming detector, with constant state per contract.
+
+    - night_leak: the minimum hourly usage during the night (local hours
+      LEAK_NIGHT_START to LEAK_NIGHT_END) was above LEAK_NIGHT_FLOW.
+    - continuous_flow: usage has not stopped for LEAK_CONTINUOUS_HOURS.
+    - anomaly: the last hourly usage is LEAK_ZSCORE deviations above the
+      EWMA baseline.
+    """
+
+    def __init__(self) -> None:
+        self.last_time: datetime | None = None
+        self.last_value: float | None = None
+        self.consecutive_hours = 0
+        self.night_min: float | None = None
+        self.last_night_min: float | None = None
+        self.mean = 0.0
+        self.variance = 0.0
+        self.samples = 0
+        self.zscore: float | None = None
+        self.problems = {x: False for x in PROBLEMS}
+
+    def _update_night(self, when: datetime, delta: float) -> None:
+        if LEAK_NIGHT_START <= when.hour < LEAK_NIGHT_END:
+            self.night_min = (
+                delta if self.night_min is None else min(self.night_min, delta)
+            )
+        elif self.night_min is not None:
+            # night is over, evaluate it
+            self.last_night_min = self.night_min
+            self.problems["night_leak"] = self.night_min > LEAK_NIGHT_FLOW
+            self.night_min = None
+
+    def _update_baseline(self, delta: float) -> None:
+        if self.samples >= LEAK_MIN_SAMPLES and self.variance > 0:
+            self.zscore = (delta - self.mean) / math.sqrt(self.variance)
+            self.problems["anomaly"] = self.zscore > LEAK_ZSCORE
+        else:
+            self.zscore = None
+
+        diff = delta - self.mean
+        self.mean += LEAK_EWMA_ALPHA * diff
+        self.variance = (1 - LEAK_EWMA_ALPHA) * (
+            self.variance + LEAK_EWMA_ALPHA * diff * diff
+        )
+        self.samples += 1
+
+    def update(self, when: datetime, value: float) -> set[str]:
+        """Add a reading, return the problems that have just been detected."""
+        if self.last_time is not None and when <= self.last_time:
+            return set()
+
+        before = {k for k, v in self.problems.items() if v}
+        consecutive = self.last_time is not None and (
+            when - self.last_time <= timedelta(hours=1)
+        )
+        if consecutive:
+            delta = max(value - self.last_value, 0.0)
+            self.consecutive_hours = self.consecutive_hours + 1 if delta > 0 else 0
+            self.problems["continuous_flow"] = (
+                self.consecutive_hours >= LEAK_CONTINUOUS_HOURS
+            )
+            self._update_night(when, delta)
+            self._update_baseline(delta)
+        else:
+            # gap in the readings, cannot tell if usage stopped
+            self.consecutive_hours = 0
+            self.night_min = None
+
+        self.last_time = when
+        self.last_value = value
+        return {k for k, v in self.problems.items() if v} - before
+
+    def extend(
+        self,
+        consumptions: list[dict],
+        key: str = "accumulatedConsumption",
+        since: datetime | None = None,
+    ) -> set[str]:
+        """Add readings, return the problems detected by readings not older
+        than `since`."""
+        detected = set()
+        for metric in consumptions:
+            when = datetime.fromisoformat(metric["datetime"])
+            problems = self.update(when, metric[key])
+            if since is None or when.timestamp() >= since.timestamp():
+                detected |= problems
+        # only report the ones still active
+        return {x for x in detected if self.problems[x]}
+
+    def as_dict(self) -> dict:
+        return {
+            "last_time": self.last_time.isoformat() if self.last_time else None,
+            "last_value": self.last_value,
+            "consecutive_hours": self.consecutive_hours,
+            "night_min": self.night_min,
+            "last_night_min": self.last_night_min,
+            "mean": self.mean,
+            "variance": self.variance,
+            "samples": self.samples,
+            "problems": self.problems,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> LeakDetector:
+        detector = cls()
+        if data.get("last_time"):
+            detector.last_time = datetime.fromisoformat(data["last_time"])
+        detector.last_value = data.get("last_value")
+        detector.consecutive_hours = data.get("consecutive_hours", 0)
+        detector.night_min = data.get("night_min")
+        detector.last_night_min = data.get("last_night_min")
+        detector.mean = data.get("mean", 0.0)
+        detector.variance = data.get("variance", 0.0)
+        detector.samples = data.get("samples", 0)
+        detector.problems.update(data.get("problems", {}))
+        return detector
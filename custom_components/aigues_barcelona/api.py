@@ -1,27 +1,194 @@
+from __future__ import annotations
+
+import asyncio
 import base64
+import codecs
+import contextlib
 import datetime
+import hashlib
 import json
 import logging
+import re
+import time
 
-import requests
+import aiohttp
 
 from .const import API_COOKIE_TOKEN
+from .const import API_ERROR_TOKEN_REVOKED
 from .const import API_HOST
+from .const import API_MAX_RETRIES
+from .const import API_RETRY_AFTER_MAX
+from .metrics import Metrics
+from .transport import backoff
+from .transport import host_policy
 from .version import VERSION
 
 TIMEOUT = 60
+CONNECT_TIMEOUT = 10
+STREAM_CHUNK_SIZE = 64 * 1024
+LAST_RESPONSE_SIZE = 1024
 
 _LOGGER: logging.Logger = logging.getLogger(__name__)
 
 
-class AiguesApiClient:
+class AiguesApiError(Exception):
+    """Base error of the API client."""
+
+
+class ServerError(AiguesApiError):
+    """Error to indicate the API failed with HTTP 5xx."""
+
+
+class NotFoundError(AiguesApiError):
+    """Error to indicate the API returned HTTP 404."""
+
+
+class BadRequestError(AiguesApiError):
+    """Error to indicate the API rejected the request with HTTP 400."""
+
+
+class AuthError(AiguesApiError):
+    """Error to indicate the API denied the request with HTTP 401."""
+
+
+class TokenRevokedError(AuthError):
+    """Error to indicate the token is not valid anymore."""
+
+
+class RateLimitedError(AiguesApiError):
+    """Error to indicate the API rejected the request with HTTP 429."""
+
+    def __init__(self, message: str, retry_after: float | None = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ConnectionFailedError(AiguesApiError):
+    """Error to indicate the API could not be reached, or timed out."""
+
+
+class CircuitOpenError(ConnectionFailedError):
+    """Error to indicate requests are paused after repeated failures."""
+
+
+def _retry_after(resp: aiohttp.ClientResponse) -> float | None:
+    # only the delay-seconds form is used by the API gateway
+    try:
+        return float(resp.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenManager:
+    """JWT of the session, claims are decoded once per token."""
+
+    def __init__(self, token: str = None) -> None:
+        self.jwt = None
+        self.claims = dict()
+        self.set(token)
+
+    def set(self, token: str) -> None:
+        if token == self.jwt:
+            return
+        self.jwt = token
+        self.claims = self._decode(token) if token else dict()
+
+    @staticmethod
+    def _decode(token: str) -> dict:
+        try:
+            data = token.split(".")[1]
+            # add padding to avoid failures
+            return json.loads(base64.urlsafe_b64decode(data + "=="))
+        except (IndexError, ValueError) as exp:
+            _LOGGER.warning(f"Invalid token: {exp}")
+            return dict()
+
+    @property
+    def expires_at(self) -> datetime.datetime | None:
+        expires = self.claims.get("exp")
+        if not expires:
+            return None
+        return datetime.datetime.fromtimestamp(expires, tz=datetime.timezone.utc)
+
+    def expires_in(self) -> datetime.timedelta | None:
+        expires = self.expires_at
+        if expires is None:
+            return None
+        return expires - datetime.datetime.now(datetime.timezone.utc)
+
+    def is_expired(self, margin: int = 0) -> bool:
+        """Check if the token has expired, or will in `margin` seconds."""
+        expires_in = self.expires_in()
+        if expires_in is None:
+            return True
+        return expires_in <= datetime.timedelta(seconds=margin)
+
+
+class JsonArrayStream:
+    """Incremental parser for the objects of one array in a JSON document.
+
+    Feed it the body in chunks and it returns the items completed so far,
+    without keeping the whole body in memory. The array must contain
+    objects or lists, as scalars cannot be told apart from a truncated one.
+    """
+
+    def __init__(self, key: str = "data"):
+        self._start = re.compile(rf'"{re.escape(key)}"\s*:\s*\[')
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._inside = False
+        self.done = False
+
+    def feed(self, chunk: bytes) -> list:
+        items = list()
+        self._buffer += self._utf8.decode(chunk)
+        if self.done:
+            return items
+
+        if not self._inside:
+            match = self._start.search(self._buffer)
+            if not match:
+                # keep the tail, the key may be split between chunks
+                self._buffer = self._buffer[-64:]
+                return items
+            self._buffer = self._buffer[match.end() :]
+            self._inside = True
+
+        buffer = self._buffer
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if buffer[pos] == "]":
+                self.done = True
+                break
+            try:
+                item, pos = self._decoder.raw_decode(buffer, pos)
+            except ValueError:
+                # incomplete item, wait for next chunk
+                break
+            items.append(item)
+
+        self._buffer = buffer[pos:]
+        return items
+
+
+class AsyncAiguesApiClient:
     def __init__(
-        self, username, password, contract=None, session: requests.Session = None
+        self,
+        username,
+        password,
+        contract=None,
+        session: aiohttp.ClientSession = None,
+        cache=None,
     ):
-        if session is None:
-            session = requests.Session()
-        self.cli = session
+        self._session = session
+        self._owns_session = session is None
         self.api_host = f"https://{API_HOST}"
+        self._limiter, self.breaker = host_policy(API_HOST)
         # https://www.aiguesdebarcelona.cat/o/ofex-theme/js/chunk-vendors.e5935b72.js
         # https://www.aiguesdebarcelona.cat/o/ofex-theme/js/app.0499d168.js
         self.headers = {
@@ -33,7 +200,26 @@ class AiguesApiClient:
         self._username = username
         self._password = password
         self._contract = contract
+        self.token = TokenManager()
+        self._login_task: asyncio.Future | None = None
+        # optional consumptions cache, see cache.ConsumptionCache
+        self.cache = cache
         self.last_response = None
+        # timings and counters of every request, see diagnostics
+        self.metrics = Metrics()
+
+    @property
+    def cli(self) -> aiohttp.ClientSession:
+        # token is sent explicitly on every request, cookie jar is not needed
+        if self._session is None:
+            self._session = aiohttp.ClientSession(cookie_jar=aiohttp.DummyCookieJar())
+        return self._session
+
+    async def close(self) -> None:
+        """Close the HTTP session, only if it was created by this client."""
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
 
     def _generate_url(self, path, query) -> str:
         query_proc = ""
@@ -41,55 +227,213 @@ class AiguesApiClient:
             query_proc = "?" + "&".join([f"{k}={v}" for k, v in query.items()])
         return f"{self.api_host}/{path.lstrip('/')}{query_proc}"
 
+    @staticmethod
+    def _endpoint(path) -> str:
+        return path.rstrip("/").rsplit("/", 1)[-1]
+
     def _return_token_field(self, key):
-        token = self.cli.cookies.get_dict().get(API_COOKIE_TOKEN)
-        if not token:
+        if not self.token.jwt:
             _LOGGER.warning("Token login missing")
             return False
 
-        data = token.split(".")[1]
-        _LOGGER.debug(data)
-        # add padding to avoid failures
-        data = base64.urlsafe_b64decode(data + "==")
-
-        return json.loads(data).get(key)
+        return self.token.claims.get(key)
 
-    def _query(self, path, query=None, json=None, headers=None, method="GET"):
+    def _request_headers(self, headers=None) -> dict:
         if headers is None:
             headers = dict()
         headers = {**self.headers, **headers}
-
-        resp = self.cli.request(
-            method=method,
-            url=self._generate_url(path, query),
-            json=json,
-            headers=headers,
-            timeout=TIMEOUT,
-        )
-        _LOGGER.debug(f"Query done with code {resp.status_code}")
-        msg = resp.text
-        self.last_response = resp.text
-        if len(msg) > 5 and (msg.startswith("{") or msg.startswith("[")):
-            msg = resp.json()
+        if self.token.jwt:
+            headers["Cookie"] = f"{API_COOKIE_TOKEN}={self.token.jwt}"
+        return headers
+
+    def _update_token(self, resp: aiohttp.ClientResponse) -> None:
+        # login sets the token as cookie: ofexTokenJwt
+        if API_COOKIE_TOKEN in resp.cookies:
+            self.token.set(resp.cookies[API_COOKIE_TOKEN].value)
+
+    def _parse_response(self, status: int, text: str, retry_after=None):
+        """Parse the body once, keep a bounded copy of it in last_response and
+        raise if the status code is an error."""
+        data = msg = text
+        self.last_response = text[:LAST_RESPONSE_SIZE]
+        if len(text) > 5 and (text.startswith("{") or text.startswith("[")):
+            with self.metrics.timer("parse"):
+                data = msg = json.loads(text)
             if isinstance(msg, list) and len(msg) == 1:
                 msg = msg[0]
-            self.last_response = msg.copy()
-            msg = msg.get("message", resp.text)
-
-        if resp.status_code == 500:
-            raise Exception(f"Server error: {msg}")
-        if resp.status_code == 404:
-            raise Exception(f"Not found: {msg}")
-        if resp.status_code == 401:
-            raise Exception(f"Denied: {msg}")
-        if resp.status_code == 400:
-            raise Exception(f"Bad response: {msg}")
-        if resp.status_code == 429:
-            raise Exception(f"Rate-Limited: {msg}")
-
-        return resp
+            if isinstance(msg, dict):
+                # do not keep a reference to the (large) list of readings
+                self.last_response = {k: v for k, v in msg.items() if k != "data"}
+                msg = msg.get("message", text)
+
+        if status >= 400 and API_ERROR_TOKEN_REVOKED in str(msg):
+            raise TokenRevokedError(f"Denied: {msg}")
+        if status >= 500:
+            raise ServerError(f"Server error: {msg}")
+        if status == 404:
+            raise NotFoundError(f"Not found: {msg}")
+        if status == 401:
+            raise AuthError(f"Denied: {msg}")
+        if status == 400:
+            raise BadRequestError(f"Bad response: {msg}")
+        if status == 429:
+            raise RateLimitedError(f"Rate-Limited: {msg}", retry_after)
 
-    def login(self, user=None, password=None, recaptcha=None):
+        return data
+
+    @contextlib.asynccontextmanager
+    async def _request(self, path, query=None, body=None, headers=None, method="GET"):
+        """Send a request through the host limiter and circuit breaker.
+
+        Timeouts, connection errors and 5xx are retried with backoff, and 429
+        after Retry-After if it is short enough. Yield the response, or raise
+        the error of the last attempt.
+        """
+        url = self._generate_url(path, query)
+        endpoint = self._endpoint(path)
+        # the breaker counts requests, not each attempt
+        if not self.breaker.allow():
+            self.metrics.count("circuit_open")
+            raise CircuitOpenError(
+                f"API unavailable, retrying in {self.breaker.retry_in():.0f}s"
+            )
+        try:
+            for attempt in range(API_MAX_RETRIES + 1):
+                if attempt:
+                    self.metrics.count("retries")
+
+                try:
+                    await self._limiter.acquire()
+                    start = time.perf_counter()
+                    resp = await self.cli.request(
+                        method=method,
+                        url=url,
+                        json=body,
+                        headers=self._request_headers(headers),
+                        timeout=aiohttp.ClientTimeout(
+                            total=TIMEOUT, sock_connect=CONNECT_TIMEOUT
+                        ),
+                    )
+                except (asyncio.TimeoutError, aiohttp.ClientError) as exp:
+                    self.metrics.count("connection_errors")
+                    if attempt < API_MAX_RETRIES:
+                        _LOGGER.debug(f"Request failed ({exp!r}), retrying")
+                        await asyncio.sleep(backoff(attempt))
+                        continue
+                    self.breaker.failure()
+                    raise ConnectionFailedError(f"Request failed: {exp!r}") from exp
+
+                # until the headers are received, the body is read by the caller
+                self.metrics.observe(f"request.{endpoint}", time.perf_counter() - start)
+                self.metrics.count(f"status_{resp.status}")
+                _LOGGER.debug(f"Query done with code {resp.status}")
+
+                delay = None
+                if resp.status >= 500:
+                    delay = backoff(attempt)
+                elif resp.status == 429:
+                    delay = _retry_after(resp)
+                    if delay is None:
+                        delay = backoff(attempt)
+                    if delay > API_RETRY_AFTER_MAX:
+                        delay = None
+
+                if delay is not None and attempt < API_MAX_RETRIES:
+                    resp.release()
+                    _LOGGER.debug(f"Got {resp.status}, retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+                    continue
+
+                if resp.status >= 500:
+                    self.breaker.failure()
+                else:
+                    self.breaker.success()
+                try:
+                    self._update_token(resp)
+                    if resp.status >= 400:
+                        self._parse_response(
+                            resp.status, await resp.text(), _retry_after(resp)
+                        )
+                    yield resp
+                finally:
+                    resp.release()
+                return
+        except asyncio.CancelledError:
+            # a cancelled trial must not keep the circuit half open
+            self.breaker.abort()
+            raise
+
+    async def _query(self, path, query=None, body=None, headers=None, method="GET"):
+        async with self._request(path, query, body, headers, method) as resp:
+            text = await resp.text()
+            return self._parse_response(resp.status, text)
+
+    async def _query_stream(self, path, query=None, headers=None, key="data"):
+        """Yield the items of the `key` array while the body is downloaded.
+
+        Error responses are read and raised as in _query.
+        """
+        async with self._request(path, query, headers=headers) as resp:
+            if resp.status >= 300:
+                self._parse_response(resp.status, await resp.text())
+                return
+
+            self.last_response = None
+            parser = JsonArrayStream(key)
+            elapsed = 0.0
+            try:
+                async for chunk in resp.content.iter_chunked(STREAM_CHUNK_SIZE):
+                    start = time.perf_counter()
+                    items = parser.feed(chunk)
+                    elapsed += time.perf_counter() - start
+                    for item in items:
+                        yield item
+                    if parser.done:
+                        return
+            finally:
+                self.metrics.observe("parse", elapsed)
+
+    async def _query_conditional(
+        self, path, query=None, headers=None, validators=None, key="data"
+    ):
+        """Request the `key` array only if it changed since `validators`.
+
+        Send ETag and Last-Modified back when the server provided them, and
+        compare a digest of the body otherwise. Return a tuple of the items,
+        None if not modified, and the new validators.
+        """
+        headers = dict(headers or {})
+        validators = validators or {}
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+        async with self._request(path, query, headers=headers) as resp:
+            if resp.status == 304:
+                self.metrics.count("not_modified")
+                return None, validators
+            if resp.status >= 300:
+                self._parse_response(resp.status, await resp.text())
+                return [], validators
+
+            body = await resp.read()
+            current = {
+                "etag": resp.headers.get("ETag"),
+                "last_modified": resp.headers.get("Last-Modified"),
+                "digest": hashlib.blake2b(body, digest_size=16).hexdigest(),
+            }
+
+        if current["digest"] == validators.get("digest"):
+            self.metrics.count("not_modified")
+            return None, current
+
+        self.last_response = None
+        parser = JsonArrayStream(key)
+        with self.metrics.timer("parse"):
+            return parser.feed(body), current
+
+    async def login(self, user=None, password=None, recaptcha=None):
         if user is None:
             user = self._username
         if password is None:
@@ -111,49 +455,44 @@ class AiguesApiClient:
             "Ocp-Apim-Subscription-Key": "6a98b8b8c7b243cda682a43f09e6588b;product=portlet-login-ofex",
         }
 
-        r = self._query(path, query, body, headers, method="POST")
+        previous = self.token.jwt
+        r = await self._query(path, query, body, headers, method="POST")
 
         _LOGGER.debug(r)
-        error = r.json().get("errorMessage", None)
+        error = r.get("errorMessage", None)
         if error:
             _LOGGER.warning(error)
             return False
 
-        access_token = r.json().get("access_token", None)
+        access_token = r.get("access_token", None)
         if not access_token:
             _LOGGER.warning("Access token missing")
             return False
 
+        # token not received as cookie
+        if self.token.jwt == previous:
+            self.token.set(access_token)
+
         return True
 
-        # set as cookie: ofexTokenJwt
-        # https://www.aiguesdebarcelona.cat/ca/area-clientes
+    async def relogin(self) -> bool:
+        """Login again, concurrent callers share the same request."""
+        if self._login_task is None or self._login_task.done():
+            self._login_task = asyncio.ensure_future(self.login())
+        try:
+            return await asyncio.shield(self._login_task)
+        except Exception as exp:
+            _LOGGER.warning(f"Login failed: {exp}")
+            return False
 
     def set_token(self, token: str):
-        host = ".".join(self.api_host.split(".")[1:])
-        cookie_data = {
-            "name": API_COOKIE_TOKEN,
-            "value": token,
-            "domain": f".{host}",
-            "path": "/",
-            "secure": True,
-            "rest": {"HttpOnly": True, "SameSite": "None"},
-        }
-        cookie = requests.cookies.create_cookie(**cookie_data)
-        return self.cli.cookies.set_cookie(cookie)
+        self.token.set(token)
 
-    def is_token_expired(self) -> bool:
+    def is_token_expired(self, margin: int = 0) -> bool:
         """Check if Token in cookie has expired or not."""
-        expires = self._return_token_field("exp")
-        if not expires:
-            return True
+        return self.token.is_expired(margin)
 
-        expires = datetime.datetime.fromtimestamp(expires)
-        NOW = datetime.datetime.now()
-
-        return NOW >= expires
-
-    def profile(self, user=None):
+    async def profile(self, user=None):
         if user is None:
             user = self._return_token_field("name")
 
@@ -163,12 +502,12 @@ class AiguesApiClient:
             "Ocp-Apim-Subscription-Key": "6a98b8b8c7b243cda682a43f09e6588b;product=portlet-login-ofex"
         }
 
-        r = self._query(path, query, headers=headers, method="POST")
+        r = await self._query(path, query, headers=headers, method="POST")
 
-        assert r.json().get("user_data"), "User data missing"
-        return r.json()
+        assert r.get("user_data"), "User data missing"
+        return r
 
-    def contracts(self, user=None, status=["ASSIGNED", "PENDING"]):
+    async def contracts(self, user=None, status=["ASSIGNED", "PENDING"]):
         if user is None:
             user = self._return_token_field("name")
         if isinstance(status, str):
@@ -179,28 +518,26 @@ class AiguesApiClient:
         for idx, stat in enumerate(status):
             query[f"assignationStatus[{str(idx)}]"] = stat.upper()
 
-        r = self._query(path, query)
+        r = await self._query(path, query)
 
-        data = r.json().get("data")
+        data = r.get("data")
         return data
 
-    @property
-    def contract_id(self):
-        return [x["contractDetail"]["contractNumber"] for x in self.contracts()]
+    async def contract_id(self):
+        return [x["contractDetail"]["contractNumber"] for x in await self.contracts()]
 
-    @property
-    def first_contract(self):
-        contract_ids = self.contract_id
+    async def first_contract(self):
+        contract_ids = await self.contract_id()
         assert (
             len(contract_ids) == 1
         ), "Provide a Contract ID to retrieve specific invoices"
         return contract_ids[0]
 
-    def invoices(self, contract=None, user=None, last_months=36, mode="ALL"):
+    async def invoices(self, contract=None, user=None, last_months=36, mode="ALL"):
         if user is None:
             user = self._return_token_field("name")
         if contract is None:
-            contract = self.first_contract
+            contract = await self.first_contract()
 
         path = "/ofex-invoices-api/invoices"
         query = {
@@ -212,21 +549,21 @@ class AiguesApiClient:
             "mode": mode,
         }
 
-        r = self._query(path, query)
+        r = await self._query(path, query)
 
-        data = r.json().get("data")
+        data = r.get("data")
         return data
 
-    def invoices_debt(self, contract=None, user=None):
-        return self.invoices(contract, user, last_months=0, mode="DEBT")
+    async def invoices_debt(self, contract=None, user=None):
+        return await self.invoices(contract, user, last_months=0, mode="DEBT")
 
-    def consumptions(
+    async def _consumptions_query(
         self, date_from, date_to=None, contract=None, user=None, frequency="HOURLY"
     ):
         if user is None:
             user = self._return_token_field("name")
         if contract is None:
-            contract = self.first_contract
+            contract = await self.first_contract()
         if frequency not in ["HOURLY", "DAILY"]:
             raise ValueError(f"Invalid {frequency=}")
 
@@ -237,7 +574,6 @@ class AiguesApiClient:
         if isinstance(date_to, datetime.date):
             date_to = date_to.strftime("%d-%m-%Y")
 
-        path = "/ofex-water-consumptions-api/meter/consumptions"
         query = {
             "consumptionFrequency": frequency,
             "contractNumber": contract,
@@ -248,25 +584,163 @@ class AiguesApiClient:
             "toDate": date_to,
             "showNegativeValues": "false",
         }
+        return query, (contract, frequency, date_from, date_to)
+
+    async def consumptions(
+        self,
+        date_from,
+        date_to=None,
+        contract=None,
+        user=None,
+        frequency="HOURLY",
+        use_cache=True,
+    ):
+        """Readings of the window, from the cache unless `use_cache` is False.
+
+        The cache is updated with the readings fetched anyway.
+        """
+        query, cache_key = await self._consumptions_query(
+            date_from, date_to, contract, user, frequency
+        )
+        path = "/ofex-water-consumptions-api/meter/consumptions"
 
-        r = self._query(path, query)
+        if self.cache is not None and use_cache:
+            data = self.cache.get(cache_key)
+            if data is not None:
+                return data
 
-        data = r.json().get("data")
+        data = [x async for x in self._query_stream(path, query)]
+        self.metrics.count("rows_fetched", len(data))
+        if self.cache is not None and data:
+            self.cache.set(cache_key, data)
         return data
 
-    def consumptions_week(self, date_from: datetime.date, contract=None, user=None):
+    async def consumptions_if_changed(
+        self,
+        date_from,
+        date_to=None,
+        contract=None,
+        user=None,
+        frequency="HOURLY",
+        validators=None,
+    ):
+        """Like consumptions, but return None if the window did not change
+        since the response of `validators`.
+
+        Return a tuple of the readings and the validators of this response.
+        The caller keeps them once the readings are processed, so readings
+        that failed to be processed are returned again.
+        """
+        query, cache_key = await self._consumptions_query(
+            date_from, date_to, contract, user, frequency
+        )
+        path = "/ofex-water-consumptions-api/meter/consumptions"
+
+        # only valid for the same window
+        if validators and validators.get("window") != list(cache_key[2:]):
+            validators = None
+
+        data, current = await self._query_conditional(
+            path, query, validators=validators
+        )
+        current = {**current, "window": list(cache_key[2:])}
+        if data is None:
+            _LOGGER.debug(f"Consumptions of {cache_key} did not change")
+            return None, current
+
+        self.metrics.count("rows_fetched", len(data))
+        if self.cache is not None and data:
+            self.cache.set(cache_key, data)
+        return data, current
+
+    async def consumptions_week(
+        self, date_from: datetime.date, contract=None, user=None
+    ):
         if date_from is None:
             date_from = datetime.datetime.now()
         # get first day of week
         monday = date_from - datetime.timedelta(days=date_from.weekday())
         sunday = monday + datetime.timedelta(days=6)
-        return self.consumptions(monday, sunday, contract, user, frequency="DAILY")
+        return await self.consumptions(
+            monday, sunday, contract, user, frequency="DAILY"
+        )
 
-    def consumptions_month(self, date_from: datetime.date, contract=None, user=None):
+    async def consumptions_month(
+        self, date_from: datetime.date, contract=None, user=None
+    ):
         first = date_from.replace(day=1)
         next_month = date_from.replace(day=28) + datetime.timedelta(days=4)
         last = next_month - datetime.timedelta(days=next_month.day)
-        return self.consumptions(first, last, contract, user, frequency="DAILY")
+        return await self.consumptions(first, last, contract, user, frequency="DAILY")
 
-    def parse_consumptions(self, info, key="accumulatedConsumption"):
+    @staticmethod
+    def parse_consumptions(info, key="accumulatedConsumption"):
         return [x[key] for x in info]
+
+
+class AiguesApiClient:
+    """Blocking wrapper around AsyncAiguesApiClient, intended for scripts.
+
+    Runs every call in a private event loop, do not use it inside Home
+    Assistant.
+    """
+
+    def __init__(self, username, password, contract=None):
+        self._loop = asyncio.new_event_loop()
+        self._client = AsyncAiguesApiClient(username, password, contract)
+
+    def _run(self, coro):
+        return self._loop.run_until_complete(coro)
+
+    def close(self):
+        self._run(self._client.close())
+        self._loop.close()
+
+    @property
+    def last_response(self):
+        return self._client.last_response
+
+    def login(self, user=None, password=None, recaptcha=None):
+        return self._run(self._client.login(user, password, recaptcha))
+
+    def set_token(self, token: str):
+        return self._client.set_token(token)
+
+    def is_token_expired(self) -> bool:
+        return self._client.is_token_expired()
+
+    def profile(self, user=None):
+        return self._run(self._client.profile(user))
+
+    def contracts(self, user=None, status=["ASSIGNED", "PENDING"]):
+        return self._run(self._client.contracts(user, status))
+
+    @property
+    def contract_id(self):
+        return self._run(self._client.contract_id())
+
+    @property
+    def first_contract(self):
+        return self._run(self._client.first_contract())
+
+    def invoices(self, contract=None, user=None, last_months=36, mode="ALL"):
+        return self._run(self._client.invoices(contract, user, last_months, mode))
+
+    def invoices_debt(self, contract=None, user=None):
+        return self._run(self._client.invoices_debt(contract, user))
+
+    def consumptions(
+        self, date_from, date_to=None, contract=None, user=None, frequency="HOURLY"
+    ):
+        return self._run(
+            self._client.consumptions(date_from, date_to, contract, user, frequency)
+        )
+
+    def consumptions_week(self, date_from: datetime.date, contract=None, user=None):
+        return self._run(self._client.consumptions_week(date_from, contract, user))
+
+    def consumptions_month(self, date_from: datetime.date, contract=None, user=None):
+        return self._run(self._client.consumptions_month(date_from, contract, user))
+
+    def parse_consumptions(self, info, key="accumulatedConsumption"):
+        return AsyncAiguesApiClient.parse_consumptions(info, key)
@@ -0,0 +1,160 @@
+"""Historic consumptions backfill, fetching date windows concurrently."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import datetime
+from datetime import timedelta
+
+from .api import AsyncAiguesApiClient
+from .api import BadRequestError
+from .api import RateLimitedError
+from .const import BACKFILL_BACKOFF_MAX
+from .const import BACKFILL_BACKOFF_MIN
+from .const import BACKFILL_DAILY_WINDOW_DAYS
+from .const import BACKFILL_MAX_RETRIES
+from .const import BACKFILL_WINDOW_DAYS
+from .const import BACKFILL_WORKERS
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def split_windows(
+    start: datetime, end: datetime, days: int = BACKFILL_WINDOW_DAYS
+) -> list[tuple[datetime, datetime]]:
+    """Split the range in consecutive windows, both dates included."""
+    windows = list()
+    current = start
+    while current < end:
+        last = min(current + timedelta(days=days - 1), end)
+        windows.append((current, last))
+        current += timedelta(days=days)
+    return windows
+
+
+def split_in_half(window: tuple) -> list[tuple]:
+    """Split a window of several days in two, both dates included."""
+    date_from, date_to = window
+    days = (date_to - date_from).days
+    if days < 1:
+        return [window]
+    middle = date_from + timedelta(days=days // 2)
+    return [(date_from, middle), (middle + timedelta(days=1), date_to)]
+
+
+class BackfillEngine:
+    """Fetch a long date range through a bounded pool of workers.
+
+    DAILY readings are requested in ranges of up to a year, HOURLY ones a
+    week at a time. If the API rejects a range, it is split in two and
+    retried. When the API returns 429, the shared delay between requests
+    is increased and the window is retried later. Every success reduces the
+    delay again. Windows that keep failing are skipped and reported in
+    `failed`, so they do not abort the whole import.
+    """
+
+    def __init__(
+        self,
+        api: AsyncAiguesApiClient,
+        contract: str,
+        frequency: str = "DAILY",
+        window_days: int | None = None,
+        workers: int = BACKFILL_WORKERS,
+        max_retries: int = BACKFILL_MAX_RETRIES,
+        use_cache: bool = True,
+    ) -> None:
+        self._api = api
+        self.contract = contract
+        self.frequency = frequency
+        if window_days is None:
+            window_days = (
+                BACKFILL_DAILY_WINDOW_DAYS
+                if frequency == "DAILY"
+                else BACKFILL_WINDOW_DAYS
+            )
+        self.window_days = window_days
+        self.workers = workers
+        self.max_retries = max_retries
+        self.use_cache = use_cache
+        self.failed: list[tuple[datetime, datetime]] = list()
+        self._delay = 0.0
+
+    def _throttle(self, retry_after: float | None = None) -> None:
+        self._delay = min(
+            max(self._delay * 2, BACKFILL_BACKOFF_MIN, retry_after or 0),
+            BACKFILL_BACKOFF_MAX,
+        )
+        _LOGGER.debug(f"Rate-limited, delaying requests {self._delay} seconds")
+
+    def _relax(self) -> None:
+        self._delay = self._delay / 2 if self._delay > BACKFILL_BACKOFF_MIN else 0.0
+
+    async def _worker(self, queue: asyncio.Queue, results: list) -> None:
+        while True:
+            try:
+                window, attempt = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+
+            if self._delay:
+                await asyncio.sleep(self._delay)
+
+            date_from, date_to = window
+            try:
+                consumptions = await self._api.consumptions(
+                    date_from,
+                    date_to,
+                    self.contract,
+                    frequency=self.frequency,
+                    use_cache=self.use_cache,
+                )
+            except BadRequestError as exp:
+                halves = split_in_half(window)
+                if len(halves) == 1:
+                    _LOGGER.warning(f"Failed to fetch data for {date_from}: {exp}")
+                    self.failed.append(window)
+                    continue
+                _LOGGER.debug(f"Range from {date_from} rejected, splitting it")
+                for half in halves:
+                    queue.put_nowait((half, attempt))
+                continue
+            except RateLimitedError as exp:
+                self._throttle(exp.retry_after)
+                if attempt < self.max_retries:
+                    queue.put_nowait((window, attempt + 1))
+                else:
+                    _LOGGER.warning(f"Giving up on {date_from} - rate-limited")
+                    self.failed.append(window)
+                continue
+            except Exception as exp:
+                _LOGGER.warning(f"Failed to fetch data for {date_from}: {exp}")
+                self.failed.append(window)
+                continue
+
+            self._relax()
+            if consumptions:
+                results.extend(consumptions)
+            else:
+                _LOGGER.warning(f"No data available for {date_from}")
+
+    async def run(self, start: datetime, end: datetime) -> list[dict]:
+        """Fetch the range and return readings merged and sorted."""
+        return await self.fetch(split_windows(start, end, self.window_days))
+
+    async def fetch(self, windows: list[tuple]) -> list[dict]:
+        """Fetch the windows and return readings merged and sorted."""
+        queue = asyncio.Queue()
+        for window in windows:
+            queue.put_nowait((window, 0))
+
+        results = list()
+        await asyncio.gather(
+            *[
+                self._worker(queue, results)
+                for _ in range(min(self.workers, queue.qsize()))
+            ]
+        )
+
+        merged = {x["datetime"]: x for x in results}
+        return [merged[key] for key in sorted(merged, key=datetime.fromisoformat)]
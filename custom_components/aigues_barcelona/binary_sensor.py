@@ -0,0 +1,60 @@
+"""Platform for binary sensor integration."""
+
+import logging
+
+from homeassistant.components.binary_sensor import BinarySensorDeviceClass
+from homeassistant.components.binary_sensor import BinarySensorEntity
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.update_coordinator import CoordinatorEntity
+
+from .anomaly import PROBLEMS
+from .const import DOMAIN
+
+_LOGGER = logging.getLogger(__name__)
+
+# key: (name, icon)
+PROBLEM_SENSORS = {
+    "night_leak": ("Fuga nocturna", "mdi:water-alert"),
+    "continuous_flow": ("Consumo continuo", "mdi:pipe-leak"),
+    "anomaly": ("Consumo anomalo", "mdi:chart-bell-curve"),
+}
+
+
+async def async_setup_entry(hass: HomeAssistant, config_entry, async_add_entities):
+    """Set up entry."""
+    cuenta = hass.data[DOMAIN][config_entry.entry_id]["account"]
+
+    async_add_entities(
+        [FugaAgua(contrato, key) for contrato in cuenta.contratos for key in PROBLEMS]
+    )
+
+    return True
+
+
+class FugaAgua(CoordinatorEntity, BinarySensorEntity):
+    """Problem detected in the consumptions, see LeakDetector."""
+
+    def __init__(self, coordinator, key: str) -> None:
+        """Initialize the sensor."""
+        super().__init__(coordinator)
+        name, icon = PROBLEM_SENSORS[key]
+        self._key = key
+        self._attr_name = f"{name} {coordinator.id}"
+        self._attr_unique_id = f"{coordinator.id}_{key}"
+        self._attr_icon = icon
+        self._attr_has_entity_name = True
+        self._attr_should_poll = False
+        self._attr_device_class = BinarySensorDeviceClass.PROBLEM
+
+    @property
+    def is_on(self):
+        return self.coordinator.detector.problems[self._key]
+
+    @property
+    def extra_state_attributes(self):
+        detector = self.coordinator.detector
+        if self._key == "night_leak":
+            return {"night_min_flow": detector.last_night_min}
+        if self._key == "continuous_flow":
+            return {"consecutive_hours": detector.consecutive_hours}
+        return {"zscore": detector.zscore, "baseline": round(detector.mean, 6)}
@@ -0,0 +1,163 @@
+"""Persistent cache of consumption API responses."""
+
+from __future__ import annotations
+
+import logging
+import time
+from collections import OrderedDict
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.storage import Store
+
+from .const import CACHE_CLOSED_MARGIN_DAYS
+from .const import CACHE_MAX_ROWS
+from .const import CACHE_OPEN_TTL
+from .const import CACHE_SAVE_DELAY
+from .const import DOMAIN
+from .const import STORAGE_VERSION
+from .history import to_epoch_hour
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class ConsumptionCache:
+    """LRU cache of consumption windows, stored with the Store helper.
+
+    Entries are keyed by (contract, frequency, fromDate, toDate). Only the
+    datetime and accumulated consumption of each reading are kept. Complete
+    windows ending a couple of days before the newest published reading do
+    not change anymore, so they never expire. Windows with holes are not
+    cached, and the rest expire after a short TTL. Once the cache holds
+    more than `max_rows` readings, the least recently used entries are
+    dropped.
+    """
+
+    def __init__(
+        self, hass: HomeAssistant, entry_id: str, max_rows: int = CACHE_MAX_ROWS
+    ) -> None:
+        self._store = Store(hass, STORAGE_VERSION, f"{DOMAIN}.{entry_id}.cache")
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        # date of the newest reading of each contract
+        self._newest: dict[str, str] = dict()
+        self._rows = 0
+        self.max_rows = max_rows
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "windows": len(self._entries),
+            "rows": self._rows,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    async def async_load(self) -> None:
+        stored = await self._store.async_load() or {}
+        now = time.time()
+        self._newest = dict(stored.get("newest", {}))
+        for key, entry in stored.get("entries", {}).items():
+            if "datetime" not in entry:
+                # stored with the whole API responses, before closing windows
+                # depended on the newest reading
+                continue
+            if entry["expires"] is None or entry["expires"] > now:
+                self._entries[key] = entry
+                self._rows += len(entry["datetime"])
+        self._evict()
+        _LOGGER.debug(f"Loaded {len(self._entries)} cached windows")
+
+    def _data_to_save(self) -> dict:
+        return {"entries": dict(self._entries), "newest": self._newest}
+
+    @staticmethod
+    def _key(key: tuple) -> str:
+        return "|".join(str(x) for x in key)
+
+    @staticmethod
+    def _has_holes(frequency: str, readings: list[datetime]) -> bool:
+        if frequency == "DAILY":
+            days = sorted({x.date() for x in readings})
+            return any((y - x).days > 1 for x, y in zip(days, days[1:]))
+        hours = sorted({to_epoch_hour(x) for x in readings})
+        return any(y - x > 1 for x, y in zip(hours, hours[1:]))
+
+    def _expires(self, key: tuple, readings: list[datetime]) -> float | None:
+        contract, frequency, date_from, date_to = key
+        try:
+            first_day = datetime.strptime(date_from, "%d-%m-%Y").date()
+            last_day = datetime.strptime(date_to, "%d-%m-%Y").date()
+        except ValueError:
+            return time.time() + CACHE_OPEN_TTL
+
+        first, last = min(readings), max(readings)
+        complete = first.date() <= first_day and last.date() >= last_day
+        if frequency != "DAILY":
+            complete = complete and first.hour == 0 and last.hour == 23
+        newest = self._newest.get(contract)
+        if (
+            complete
+            and newest is not None
+            and last_day
+            < date.fromisoformat(newest) - timedelta(days=CACHE_CLOSED_MARGIN_DAYS)
+        ):
+            return None
+        return time.time() + CACHE_OPEN_TTL
+
+    def _evict(self) -> None:
+        while self._rows > self.max_rows and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self._rows -= len(entry["datetime"])
+
+    def _pop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._rows -= len(entry["datetime"])
+
+    def get(self, key: tuple) -> list | None:
+        """Return the cached readings, or None if missing or expired."""
+        key = self._key(key)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if entry["expires"] is not None and entry["expires"] <= time.time():
+            self._pop(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return [
+            {"datetime": x, "accumulatedConsumption": y}
+            for x, y in zip(entry["datetime"], entry["value"])
+        ]
+
+    def set(self, key: tuple, data: list) -> None:
+        """Store the readings of a window, key is (contract, frequency, from,
+        to)."""
+        readings = [datetime.fromisoformat(x["datetime"]) for x in data]
+        newest = max(readings).date().isoformat()
+        if newest > self._newest.get(key[0], ""):
+            self._newest[key[0]] = newest
+
+        name = self._key(key)
+        self._pop(name)
+        if self._has_holes(key[1], readings):
+            _LOGGER.debug(f"Not caching {name}, some readings are missing")
+            self._store.async_delay_save(self._data_to_save, CACHE_SAVE_DELAY)
+            return
+
+        self._entries[name] = {
+            "expires": self._expires(key, readings),
+            "datetime": [x["datetime"] for x in data],
+            "value": [x["accumulatedConsumption"] for x in data],
+        }
+        self._rows += len(data)
+        self._evict()
+        self._store.async_delay_save(self._data_to_save, CACHE_SAVE_DELAY)
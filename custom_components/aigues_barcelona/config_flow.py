@@ -11,13 +11,22 @@ from homeassistant import config_entries
 from homeassistant.const import CONF_PASSWORD
 from homeassistant.const import CONF_TOKEN
 from homeassistant.const import CONF_USERNAME
+from homeassistant.core import callback
 from homeassistant.data_entry_flow import FlowResult
 from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
 
-from .api import AiguesApiClient
-from .const import API_ERROR_TOKEN_REVOKED
+from .api import AsyncAiguesApiClient
+from .api import ConnectionFailedError
+from .api import TokenRevokedError
 from .const import CONF_CONTRACT
+from .const import CONF_REFRESH_CONCURRENCY
+from .const import CONF_REFRESH_TIMEOUT
+from .const import CONF_TARIFF
+from .const import DEFAULT_REFRESH_CONCURRENCY
+from .const import DEFAULT_REFRESH_TIMEOUT
 from .const import DOMAIN
+from .tariff import TariffModel
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -61,21 +70,28 @@ async def validate_credentials(
     if not check_valid_nif(username):
         raise InvalidUsername
 
+    api = AsyncAiguesApiClient(
+        username, password, session=async_get_clientsession(hass)
+    )
     try:
-        api = AiguesApiClient(username, password)
         if token:
             api.set_token(token)
         else:
             _LOGGER.info("Attempting to login")
-            login = await hass.async_add_executor_job(api.login)
+            login = await api.login()
             if not login:
                 raise InvalidAuth
             _LOGGER.info("Login succeeded!")
-        contracts = await hass.async_add_executor_job(api.contracts, username)
+        contracts = await api.contracts(username)
 
         available_contracts = [x["contractDetail"]["contractNumber"] for x in contracts]
         return {CONF_CONTRACT: available_contracts}
 
+    except TokenRevokedError as exp:
+        raise TokenExpired from exp
+    except ConnectionFailedError as exp:
+        # also when the circuit breaker is open
+        raise CannotConnect from exp
     except Exception:
         _LOGGER.debug(f"Last data: {api.last_response}")
         if not api.last_response:
@@ -87,12 +103,6 @@ async def validate_credentials(
         ):
             raise RecaptchaAppeared
 
-        if (
-            isinstance(api.last_response, str)
-            and api.last_response == API_ERROR_TOKEN_REVOKED
-        ):
-            raise TokenExpired
-
         return False
 
 
@@ -100,6 +110,11 @@ class AiguesBarcelonaConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
     VERSION = 2
     stored_input = dict()
 
+    @staticmethod
+    @callback
+    def async_get_options_flow(config_entry):
+        return AiguesBarcelonaOptionsFlow(config_entry)
+
     async def async_step_token(
         self, user_input: dict[str, Any] | None = None
     ) -> FlowResult:
@@ -163,6 +178,8 @@ class AiguesBarcelonaConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
             errors["base"] = "invalid_auth"
         except InvalidAuth:
             errors["base"] = "invalid_auth"
+        except CannotConnect:
+            errors["base"] = "cannot_connect"
 
         return self.async_show_form(
             step_id="reauth_confirm", data_schema=TOKEN_SCHEMA, errors=errors
@@ -203,6 +220,8 @@ class AiguesBarcelonaConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
             errors["base"] = "invalid_auth"
         except InvalidAuth:
             errors["base"] = "invalid_auth"
+        except CannotConnect:
+            errors["base"] = "cannot_connect"
         except AlreadyConfigured:
             errors["base"] = "already_configured"
         else:
@@ -218,6 +237,45 @@ class AiguesBarcelonaConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         )
 
 
+class AiguesBarcelonaOptionsFlow(config_entries.OptionsFlow):
+    def __init__(self, config_entry) -> None:
+        self._entry = config_entry
+
+    async def async_step_init(
+        self, user_input: dict[str, Any] | None = None
+    ) -> FlowResult:
+        """Manage refresh and tariff options."""
+        errors = dict()
+        if user_input is not None:
+            try:
+                tariff = TariffModel.parse(user_input.get(CONF_TARIFF, ""))
+            except ValueError:
+                errors[CONF_TARIFF] = "invalid_tariff"
+            else:
+                user_input[CONF_TARIFF] = tariff.format() if tariff else ""
+                return self.async_create_entry(title="", data=user_input)
+
+        options = self._entry.options
+        schema = vol.Schema(
+            {
+                vol.Optional(
+                    CONF_REFRESH_CONCURRENCY,
+                    default=options.get(
+                        CONF_REFRESH_CONCURRENCY, DEFAULT_REFRESH_CONCURRENCY
+                    ),
+                ): vol.All(vol.Coerce(int), vol.Range(min=1, max=20)),
+                vol.Optional(
+                    CONF_REFRESH_TIMEOUT,
+                    default=options.get(CONF_REFRESH_TIMEOUT, DEFAULT_REFRESH_TIMEOUT),
+                ): vol.All(vol.Coerce(int), vol.Range(min=10, max=600)),
+                vol.Optional(
+                    CONF_TARIFF, default=options.get(CONF_TARIFF, "")
+                ): cv.string,
+            }
+        )
+        return self.async_show_form(step_id="init", data_schema=schema, errors=errors)
+
+
 class AlreadyConfigured(HomeAssistantError):
     """Error to indicate integration is already configured."""
 
@@ -231,6 +289,10 @@ class TokenExpired(HomeAssistantError):
     """Error to indicate the OAuth token has expired."""
 
 
+class CannotConnect(HomeAssistantError):
+    """Error to indicate the API could not be reached."""
+
+
 class InvalidAuth(HomeAssistantError):
     """Error to indicate credentials are invalid."""
 
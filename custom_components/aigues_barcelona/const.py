@@ -4,12 +4,102 @@ DOMAIN = "aigues_barcelona"
 
 CONF_CONTRACT = "contract"
 CONF_VALUE = "value"
+CONF_REFRESH_CONCURRENCY = "refresh_concurrency"
+CONF_REFRESH_TIMEOUT = "refresh_timeout"
+CONF_TARIFF = "tariff"
 
 ATTR_LAST_MEASURE = "Last measure"
 
 DEFAULT_SCAN_PERIOD = 14400
+DEFAULT_REFRESH_CONCURRENCY = 4
+DEFAULT_REFRESH_TIMEOUT = 120
 
 API_HOST = "api.aiguesdebarcelona.cat"
 API_COOKIE_TOKEN = "ofexTokenJwt"
 
 API_ERROR_TOKEN_REVOKED = "JWT Token Revoked"
+
+# seconds
+API_MAX_RETRIES = 3
+API_BACKOFF_MIN = 1
+API_BACKOFF_MAX = 30
+# wait for Retry-After up to this, raise RateLimitedError otherwise
+API_RETRY_AFTER_MAX = 60
+API_BREAKER_THRESHOLD = 5
+API_BREAKER_COOLDOWN = 300
+# requests per second to the API host
+API_RATE_LIMIT = 2
+API_RATE_BURST = 5
+
+BACKFILL_WINDOW_DAYS = 7
+# DAILY readings are requested in large ranges, split if rejected
+BACKFILL_DAILY_WINDOW_DAYS = 366
+BACKFILL_HISTORY_DAYS = 365
+# recent days imported as HOURLY after the DAILY history
+BACKFILL_REFINE_DAYS = 60
+# seconds between the windows of a backfill job, finished jobs kept
+JOBS_WINDOW_DELAY = 2
+JOBS_HISTORY = 10
+BACKFILL_WORKERS = 4
+BACKFILL_MAX_RETRIES = 5
+BACKFILL_BACKOFF_MIN = 1
+BACKFILL_BACKOFF_MAX = 60
+
+# hours missing in the statistics are looked for once every interval
+GAPS_SCAN_DAYS = 60
+GAPS_SCAN_INTERVAL = 6 * 3600
+GAPS_MERGE_DAYS = 1
+
+STORAGE_VERSION = 1
+
+CACHE_MAX_ROWS = 100000
+CACHE_OPEN_TTL = 1800
+CACHE_CLOSED_MARGIN_DAYS = 2
+CACHE_SAVE_DELAY = 30
+
+STATISTICS_CHUNK_SIZE = 1000
+STATISTICS_MAX_BACKLOG = 1000
+STATISTICS_BACKLOG_WAIT = 2
+STATISTICS_BACKLOG_RETRIES = 30
+# days before an import to look for the last statistic
+STATISTICS_BASELINE_DAYS = 2
+# hours remembered as imported, to skip the unchanged ones
+IMPORT_INDEX_MAX_HOURS = 24 * 400
+IMPORT_INDEX_SAVE_DELAY = 30
+
+# recent hourly readings kept in memory, see ConsumptionHistory
+HISTORY_MAX_HOURS = 24 * 62
+
+# histogram bounds in seconds, and samples kept for percentiles
+METRICS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+METRICS_SAMPLES = 200
+
+# invoices are issued every one or two months
+INVOICE_SCAN_PERIOD = 86400
+INVOICE_HISTORY_MONTHS = 36
+
+EVENT_LEAK_DETECTED = f"{DOMAIN}_leak_detected"
+EVENT_BACKFILL_PROGRESS = f"{DOMAIN}_backfill_progress"
+# local hours, [start, end)
+LEAK_NIGHT_START = 2
+LEAK_NIGHT_END = 5
+# m3 per hour
+LEAK_NIGHT_FLOW = 0.005
+LEAK_CONTINUOUS_HOURS = 24
+LEAK_EWMA_ALPHA = 0.05
+LEAK_ZSCORE = 4
+LEAK_MIN_SAMPLES = 48
+# older readings update the detector, but do not fire events
+LEAK_EVENT_MAX_DAYS = 7
+
+# seconds before the token expires to login again
+TOKEN_REFRESH_MARGIN = 600
+
+# polling intervals, in seconds
+SCHEDULER_MIN_INTERVAL = 900
+SCHEDULER_MAX_INTERVAL = 6 * 3600
+SCHEDULER_THROTTLE_INTERVAL = 3600
+# max offset per config entry and per contract
+SCHEDULER_JITTER = 300
+SCHEDULER_CONTRACT_JITTER = 10
+SCHEDULER_SAMPLES = 14
@@ -0,0 +1,900 @@
+"""Data update coordinators for Aigues de Barcelona."""
+
+# from __future__ import annotations
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime
+from datetime import timedelta
+
+import homeassistant.components.recorder.util as recorder_util
+
+try:
+    from homeassistant.components.recorder.const import (
+        DATA_INSTANCE as RECORDER_DATA_INSTANCE,
+    )
+except ImportError:  # NEW Home Assistant 2024.08
+    from homeassistant.helpers.recorder import (
+        DATA_INSTANCE as RECORDER_DATA_INSTANCE,
+    )
+from homeassistant.components.recorder.statistics import async_add_external_statistics
+from homeassistant.components.recorder.statistics import async_import_statistics
+from homeassistant.components.recorder.statistics import clear_statistics
+from homeassistant.components.recorder.statistics import get_last_statistics
+from homeassistant.components.recorder.statistics import list_statistic_ids
+from homeassistant.components.recorder.statistics import statistics_during_period
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import CONF_STATE
+from homeassistant.const import CONF_TOKEN
+from homeassistant.const import CURRENCY_EURO
+from homeassistant.const import EVENT_HOMEASSISTANT_START
+from homeassistant.const import UnitOfVolume
+from homeassistant.core import callback
+from homeassistant.core import CoreState
+from homeassistant.core import HomeAssistant
+from homeassistant.exceptions import ConfigEntryAuthFailed
+from homeassistant.helpers.storage import Store
+from homeassistant.helpers.update_coordinator import TimestampDataUpdateCoordinator
+from homeassistant.helpers.update_coordinator import UpdateFailed
+from homeassistant.util import dt as dt_util
+
+from .anomaly import LeakDetector
+from .api import AsyncAiguesApiClient
+from .api import ConnectionFailedError
+from .api import RateLimitedError
+from .api import TokenRevokedError
+from .backfill import BackfillEngine
+from .const import BACKFILL_HISTORY_DAYS
+from .const import CONF_CONTRACT
+from .const import CONF_REFRESH_CONCURRENCY
+from .const import CONF_REFRESH_TIMEOUT
+from .const import CONF_TARIFF
+from .const import CONF_VALUE
+from .const import DEFAULT_REFRESH_CONCURRENCY
+from .const import DEFAULT_REFRESH_TIMEOUT
+from .const import DEFAULT_SCAN_PERIOD
+from .const import DOMAIN
+from .const import EVENT_LEAK_DETECTED
+from .const import GAPS_SCAN_DAYS
+from .const import GAPS_SCAN_INTERVAL
+from .const import IMPORT_INDEX_SAVE_DELAY
+from .const import INVOICE_SCAN_PERIOD
+from .const import LEAK_EVENT_MAX_DAYS
+from .const import SCHEDULER_CONTRACT_JITTER
+from .const import STATISTICS_BACKLOG_RETRIES
+from .const import STATISTICS_BACKLOG_WAIT
+from .const import STATISTICS_BASELINE_DAYS
+from .const import STATISTICS_MAX_BACKLOG
+from .const import STORAGE_VERSION
+from .const import TOKEN_REFRESH_MARGIN
+from .gaps import hour_ranges
+from .gaps import missing_ranges
+from .gaps import repair_windows
+from .history import ConsumptionAggregates
+from .history import ConsumptionHistory
+from .history import from_epoch_hour
+from .history import to_epoch_hour
+from .invoices import InvoiceIndex
+from .scheduler import PollScheduler
+from .statistics import build_cost_statistics
+from .statistics import build_statistics
+from .statistics import chunk_statistics
+from .statistics import ImportIndex
+from .tariff import TariffModel
+
+from typing import Optional
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def get_db_instance(hass):
+    """Workaround for older HA versions."""
+    try:
+        return recorder_util.get_instance(hass)
+    except AttributeError:
+        return hass
+
+
+def create_background_task(hass: HomeAssistant, target, name: str) -> asyncio.Task:
+    """Workaround for older HA versions, that wait for every task to stop."""
+    if hasattr(hass, "async_create_background_task"):
+        return hass.async_create_background_task(target, name)
+    return hass.async_create_task(target)
+
+
+@callback
+def async_save_token(
+    hass: HomeAssistant, entry_id: str, api: AsyncAiguesApiClient
+) -> None:
+    """Keep the token of a new login, so it is used after a restart."""
+    entry = hass.config_entries.async_get_entry(entry_id)
+    if entry is None or not api.token.jwt:
+        return
+    if entry.data.get(CONF_TOKEN) == api.token.jwt:
+        return
+    hass.config_entries.async_update_entry(
+        entry, data={**entry.data, CONF_TOKEN: api.token.jwt}
+    )
+
+
+class ContratoAgua(TimestampDataUpdateCoordinator):
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        api: AsyncAiguesApiClient,
+        contract: str,
+        prev_data=None,
+    ) -> None:
+        """Initialize the data handler."""
+        self.reset = prev_data is None
+
+        self.contract = contract.upper()
+        self.id = contract.lower()
+        self.internal_sensor_id = f"sensor.contador_{self.id}"
+        self.cost_statistic_id = f"{DOMAIN}:cost_{self.id}"
+        # tariff from options, the invoices are used otherwise
+        self.tariff_config: Optional[TariffModel] = None
+        self.facturas: Optional[FacturasAgua] = None
+
+        if not hass.data[DOMAIN].get(self.contract):
+            # init data shared store
+            hass.data[DOMAIN][self.contract] = {}
+
+        # create alias
+        self._data = hass.data[DOMAIN][self.contract]
+
+        # WARN define a pointer to this object
+        hass.data[DOMAIN][self.contract]["coordinator"] = self
+
+        # recent hourly readings, queryable without another API call
+        self._data.setdefault("history", ConsumptionHistory())
+        self._data.setdefault("detector", LeakDetector())
+
+        # persisted state: sync cursor and last known value
+        self._store = Store(hass, STORAGE_VERSION, f"{DOMAIN}.{self.id}")
+        self._cursor: Optional[datetime] = None
+        # hours the API has no readings for, as [start, end) epoch hours
+        self._gaps_skip: list[tuple[int, int]] = list()
+        self._gaps_scanned: Optional[datetime] = None
+        # hours already imported, only new or corrected ones are submitted
+        self.imported = ImportIndex()
+        self._imported_store = Store(
+            hass, STORAGE_VERSION, f"{DOMAIN}.{self.id}.imported"
+        )
+        # backfill jobs of the entry, see JobQueue
+        self.jobs = None
+        # validators of the last window processed, and of the last fetched
+        self._validators: dict = dict()
+        self._fetched_validators: dict = dict()
+
+        # the api object, shared by all contracts of the account
+        self._api = api
+
+        super().__init__(
+            hass,
+            _LOGGER,
+            name=self.id,
+            # refreshed by CuentaAgua, along with the rest of contracts
+            update_interval=None,
+        )
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.contract}>"
+
+    @property
+    def history(self) -> ConsumptionHistory:
+        return self._data["history"]
+
+    @property
+    def aggregates(self) -> ConsumptionAggregates:
+        """Usage per period, for derived sensors."""
+        return ConsumptionAggregates(self.history, dt_util.DEFAULT_TIME_ZONE)
+
+    @property
+    def detector(self) -> LeakDetector:
+        return self._data["detector"]
+
+    @property
+    def tariff(self) -> Optional[TariffModel]:
+        if self.tariff_config is not None:
+            return self.tariff_config
+        if self.facturas is not None:
+            price = self.facturas.index.cost_per_m3()
+            if price:
+                return TariffModel.flat(price)
+        return None
+
+    @property
+    def newest(self) -> Optional[datetime]:
+        """Datetime of the most recent reading, in UTC."""
+        try:
+            return dt_util.as_utc(
+                datetime.fromisoformat(self._data.get(CONF_STATE, ""))
+            )
+        except ValueError:
+            return None
+
+    async def async_fetch_consumptions(self) -> Optional[list]:
+        """Request the consumptions not imported yet, None if they did not
+        change since the last request."""
+        TODAY = datetime.now()
+        LAST_WEEK = TODAY - timedelta(days=7)
+
+        if self._cursor is None:
+            self._cursor = await self._async_load_cursor()
+            _LOGGER.info(f"Sync cursor for {self.contract}: {self._cursor}")
+
+        # only request the days not imported yet
+        date_from = LAST_WEEK
+        if self._cursor:
+            date_from = max(
+                LAST_WEEK, dt_util.as_local(self._cursor).replace(tzinfo=None)
+            )
+
+        consumptions = []
+        try:
+            if self._api.is_token_expired():
+                raise ConfigEntryAuthFailed
+            # TODO: change once recaptcha is fiexd
+            # await self._api.login()
+            consumptions, validators = await self._api.consumptions_if_changed(
+                date_from, TODAY, self.contract, validators=self._validators
+            )
+            if consumptions is None:
+                return None
+            # kept once the readings are imported, see async_process_consumptions
+            self._fetched_validators = validators
+        except (ConfigEntryAuthFailed, TokenRevokedError) as exp:
+            _LOGGER.error("Token has expired, cannot check consumptions.")
+            raise ConfigEntryAuthFailed from exp
+        except (RateLimitedError, ConnectionFailedError):
+            # let the account slow down
+            raise
+        except Exception as exp:
+            self.async_set_update_error(exp)
+
+        return consumptions or []
+
+    async def async_process_consumptions(self, consumptions: list) -> bool:
+        """Update the current value and import the new statistics."""
+        if not consumptions:
+            _LOGGER.error("No consumptions available")
+            return False
+
+        if self._cursor is None:
+            # nothing imported yet, neither in the recorder nor by this entry:
+            # the history is imported in the background, and then the cursor
+            # is read from the recorder
+            await self._async_queue_history()
+            return False
+
+        previous = self.newest
+
+        self.history.extend(consumptions)
+
+        # get last entry - most updated
+        metric = consumptions[-1]
+
+        # skip the readings already imported
+        consumptions = [
+            x
+            for x in consumptions
+            if dt_util.as_utc(datetime.fromisoformat(x["datetime"])) > self._cursor
+        ]
+
+        # only new readings, and only recent ones are reported
+        since = dt_util.now() - timedelta(days=LEAK_EVENT_MAX_DAYS)
+        for problem in self.detector.extend(consumptions, since=since):
+            _LOGGER.warning(f"Detected {problem} for {self.contract}")
+            self.hass.bus.async_fire(
+                EVENT_LEAK_DETECTED, {"contract": self.contract, "type": problem}
+            )
+
+        # coalesce with the repair, to import all at once
+        to_import = consumptions
+        if self._gaps_scan_due() and not self.refining:
+            end = self._cursor + timedelta(hours=1)
+            if consumptions:
+                end = datetime.fromisoformat(consumptions[0]["datetime"])
+            try:
+                gaps = await self.async_fetch_gaps(end, previous)
+            except Exception as exp:
+                # e.g. the recorder is not ready, retried on the next scan
+                _LOGGER.warning(f"Failed to check missing statistics: {exp}")
+                gaps = []
+            to_import = gaps + consumptions
+
+        # await self._clear_statistics()
+        imported = True
+        if to_import:
+            try:
+                await self._async_import_statistics(to_import)
+                if consumptions:
+                    self._cursor = dt_util.as_utc(
+                        datetime.fromisoformat(consumptions[-1]["datetime"])
+                    )
+            except Exception as exp:
+                _LOGGER.warning(f"Failed to import statistics: {exp}")
+                imported = False
+
+        if imported:
+            self._data[CONF_VALUE] = metric["accumulatedConsumption"]
+            self._data[CONF_STATE] = metric["datetime"]
+            self._validators = self._fetched_validators
+        await self._async_save_snapshot()
+
+        return True
+
+    def _gaps_scan_due(self) -> bool:
+        if self._gaps_scanned is None:
+            return True
+        elapsed = dt_util.utcnow() - self._gaps_scanned
+        return elapsed >= timedelta(seconds=GAPS_SCAN_INTERVAL)
+
+    def _stored_hours(self, start: datetime, end: datetime) -> list[int]:
+        rows = statistics_during_period(
+            self.hass,
+            start,
+            end,
+            {self.internal_sensor_id},
+            "hour",
+            None,
+            {"state"},
+        )
+        hours = list()
+        for row in rows.get(self.internal_sensor_id, []):
+            # older HA versions return datetime instead of timestamp
+            if isinstance(row["start"], datetime):
+                hours.append(to_epoch_hour(row["start"]))
+            else:
+                hours.append(int(row["start"]) // 3600)
+        return hours
+
+    async def async_fetch_gaps(
+        self, end: datetime, since: Optional[datetime] = None
+    ) -> list:
+        """Request the readings of the hours missing in the statistics.
+
+        Hours are checked from the first statistic of the last days, or from
+        `since` if older, until `end` excluded. Only the days with missing
+        hours are requested.
+        """
+        self._gaps_scanned = dt_util.utcnow()
+        start = self._gaps_scanned - timedelta(days=GAPS_SCAN_DAYS)
+        if since is not None and since < start:
+            start = since
+        # not repaired anymore
+        self._gaps_skip = [x for x in self._gaps_skip if x[1] > to_epoch_hour(start)]
+
+        stored = await get_db_instance(self.hass).async_add_executor_job(
+            self._stored_hours, start, dt_util.as_utc(end)
+        )
+        if not stored:
+            return []
+        ranges = missing_ranges(
+            stored, min(stored), to_epoch_hour(end), self._gaps_skip
+        )
+        if not ranges:
+            return []
+
+        tz = dt_util.DEFAULT_TIME_ZONE
+        windows = repair_windows(ranges, tz)
+        missing = {x for first, last in ranges for x in range(first, last)}
+        _LOGGER.info(
+            f"Found {len(missing)} missing hours for {self.contract}, "
+            f"requesting {len(windows)} windows"
+        )
+        # the cache may hold the same incomplete windows
+        engine = BackfillEngine(
+            self._api, self.contract, frequency="HOURLY", use_cache=False
+        )
+        with self._api.metrics.timer("gaps"):
+            readings = await engine.fetch(windows)
+        self._api.metrics.count("gaps_hours", len(missing))
+
+        found = [x for x in readings if to_epoch_hour(x["datetime"]) in missing]
+        # missing in the recorder, even if the index has them
+        self.imported.discard(missing)
+        # do not request again the hours without readings, unless failed
+        failed = engine.failed
+        empty = missing - {to_epoch_hour(x["datetime"]) for x in found}
+        empty = [
+            x
+            for x in empty
+            if not any(
+                first <= from_epoch_hour(x).astimezone(tz).date() <= last
+                for first, last in failed
+            )
+        ]
+        self._gaps_skip = hour_ranges(
+            [x for first, last in self._gaps_skip for x in range(first, last)] + empty
+        )
+        return found
+
+    async def _async_update_data(self):
+        _LOGGER.info(f"Updating coordinator data for {self.contract}")
+        consumptions = await self.async_fetch_consumptions()
+        if consumptions is None:
+            return self.data
+        return await self.async_process_consumptions(consumptions)
+
+    async def _clear_statistics(self) -> None:
+        all_ids = await get_db_instance(self.hass).async_add_executor_job(
+            list_statistic_ids, self.hass
+        )
+        to_clear = [
+            x["statistic_id"]
+            for x in all_ids
+            if x["statistic_id"].startswith(self.internal_sensor_id)
+        ]
+
+        if to_clear:
+            _LOGGER.warn(
+                f"About to delete {len(to_clear)} entries from {self.contract}"
+            )
+            # NOTE: This does not seem to work?
+            await get_db_instance(self.hass).async_add_executor_job(
+                clear_statistics, self.hass.data[RECORDER_DATA_INSTANCE], to_clear
+            )
+        self.imported.clear()
+        self._imported_store.async_delay_save(
+            self.imported.as_dict, IMPORT_INDEX_SAVE_DELAY
+        )
+
+    async def get_last_measurement_stored(self) -> Optional[datetime]:
+        last_stats = await get_db_instance(self.hass).async_add_executor_job(
+            get_last_statistics, self.hass, 1, self.internal_sensor_id, True, {"sum"}
+        )
+
+        last_stored = last_stats.get(self.internal_sensor_id)
+        if not last_stored:
+            return None
+
+        _LOGGER.debug(f"Found last stored value: {last_stored[0]}")
+        start = last_stored[0]["start"]
+        # older HA versions return datetime instead of timestamp
+        if isinstance(start, datetime):
+            return dt_util.as_utc(start)
+        return dt_util.utc_from_timestamp(start)
+
+    async def async_restore_snapshot(self) -> None:
+        """Restore last known value and sync cursor, so entities have a state
+        before the first refresh."""
+        stored = await self._store.async_load() or {}
+        if stored.get("cursor"):
+            self._cursor = dt_util.as_utc(datetime.fromisoformat(stored["cursor"]))
+        for key in (CONF_VALUE, CONF_STATE):
+            if stored.get(key) is not None:
+                self._data.setdefault(key, stored[key])
+        if stored.get("history"):
+            self._data["history"] = ConsumptionHistory.from_dict(stored["history"])
+        if stored.get("detector"):
+            self._data["detector"] = LeakDetector.from_dict(stored["detector"])
+        self._gaps_skip = [tuple(x) for x in stored.get("gaps_skip", [])]
+        imported = await self._imported_store.async_load()
+        if imported:
+            self.imported = ImportIndex.from_dict(imported)
+
+    async def async_flush(self) -> None:
+        """Write the import index now, instead of after the delay."""
+        await self._imported_store.async_save(self.imported.as_dict())
+
+    async def _async_save_snapshot(self) -> None:
+        await self._store.async_save(
+            {
+                "cursor": self._cursor.isoformat() if self._cursor else None,
+                CONF_VALUE: self._data.get(CONF_VALUE),
+                CONF_STATE: self._data.get(CONF_STATE),
+                "history": self.history.as_dict(),
+                "detector": self.detector.as_dict(),
+                "gaps_skip": self._gaps_skip,
+            }
+        )
+
+    async def _async_load_cursor(self) -> Optional[datetime]:
+        """Find the datetime of the last reading imported in the recorder.
+
+        The last reading received is not used, it may not have been imported.
+        """
+        try:
+            return await self.get_last_measurement_stored()
+        except Exception as exp:
+            raise UpdateFailed(f"Could not read the last statistic: {exp}") from exp
+
+    async def _async_wait_recorder(self) -> None:
+        """Wait while the recorder queue is too deep."""
+        for _ in range(STATISTICS_BACKLOG_RETRIES):
+            backlog = getattr(get_db_instance(self.hass), "backlog", 0)
+            if backlog < STATISTICS_MAX_BACKLOG:
+                return
+            _LOGGER.debug(f"Recorder backlog is {backlog}, waiting to import")
+            await asyncio.sleep(STATISTICS_BACKLOG_WAIT)
+
+    def _last_statistics(
+        self, before: datetime, statistic_ids: set[str], types: set[str]
+    ) -> dict[str, dict]:
+        """Last row of each statistic before `before`, however old it is."""
+        last = dict()
+        # usually in the last days, DAILY statistics have a row per day only
+        for since in (
+            before - timedelta(days=STATISTICS_BASELINE_DAYS),
+            dt_util.utc_from_timestamp(0),
+        ):
+            missing = statistic_ids - last.keys()
+            if not missing:
+                break
+            rows = statistics_during_period(
+                self.hass, since, before, missing, "hour", None, types
+            )
+            last.update({k: v[-1] for k, v in rows.items() if v})
+        return last
+
+    def _cost_baseline(self, start: datetime) -> tuple:
+        """Cost sum and meter value before `start`, and meter value when its
+        month started."""
+        rows = self._last_statistics(
+            start, {self.internal_sensor_id, self.cost_statistic_id}, {"state", "sum"}
+        )
+        value = rows.get(self.internal_sensor_id, {}).get("state")
+        cost_sum = rows.get(self.cost_statistic_id, {}).get("sum") or 0.0
+
+        month_start = start.replace(day=1, hour=0)
+        if start - timedelta(hours=1) < month_start:
+            return cost_sum, value, value
+        rows = self._last_statistics(month_start, {self.internal_sensor_id}, {"state"})
+        month_value = rows.get(self.internal_sensor_id, {}).get("state")
+        return cost_sum, value, month_value
+
+    def _build_statistics(self, consumptions, tariff: Optional[TariffModel]):
+        stats = build_statistics(consumptions)
+        if tariff is None or not stats:
+            return stats, []
+        baseline = self._cost_baseline(stats[0]["start"])
+        return stats, build_cost_statistics(stats, tariff, *baseline)
+
+    async def _async_import_statistics(self, consumptions) -> None:
+        metrics = self._api.metrics
+        start = time.perf_counter()
+        # CPU bound on large imports, keep it out of the event loop
+        with metrics.timer("build_statistics"):
+            stats, costs = await get_db_instance(self.hass).async_add_executor_job(
+                self._build_statistics, consumptions, self.tariff
+            )
+        changed = self.imported.changed(stats, costs)
+        metrics.count("rows_unchanged", len(stats) - len(changed))
+        if len(changed) < len(stats):
+            stats = [stats[x] for x in changed]
+            costs = [costs[x] for x in changed] if costs else costs
+        if not stats:
+            _LOGGER.debug(f"Statistics of {self.contract} already imported")
+            return
+        metadata = {
+            "has_mean": False,
+            "has_sum": True,
+            "name": None,
+            "source": "recorder",  # required
+            "statistic_id": self.internal_sensor_id,
+            "unit_of_measurement": UnitOfVolume.CUBIC_METERS,
+        }
+        # _LOGGER.debug(f"Adding metric: {metadata} {stats}")
+        for chunk in chunk_statistics(stats):
+            await self._async_wait_recorder()
+            async_import_statistics(self.hass, metadata, chunk)
+
+        if costs:
+            metadata = {
+                "has_mean": False,
+                "has_sum": True,
+                "name": f"Coste {self.id}",
+                "source": DOMAIN,
+                "statistic_id": self.cost_statistic_id,
+                "unit_of_measurement": CURRENCY_EURO,
+            }
+            for chunk in chunk_statistics(costs):
+                await self._async_wait_recorder()
+                async_add_external_statistics(self.hass, metadata, chunk)
+
+        self.imported.add(stats, costs)
+        self._imported_store.async_delay_save(
+            self.imported.as_dict, IMPORT_INDEX_SAVE_DELAY
+        )
+
+        # queued to the recorder, writing them is not included
+        metrics.observe("import", time.perf_counter() - start)
+        metrics.count("rows_imported", len(stats))
+
+    async def clear_all_stored_data(self) -> None:
+        await self._clear_statistics()
+
+    async def async_fetch_old_consumptions(self, days: int = 365) -> list:
+        today = datetime.now()
+        one_year_ago = today - timedelta(days=days)
+
+        if self._api.is_token_expired():
+            raise ConfigEntryAuthFailed
+
+        engine = BackfillEngine(self._api, self.contract)
+        with self._api.metrics.timer("backfill"):
+            consumptions = await engine.run(one_year_ago, today)
+        self._api.metrics.count("backfill_failed_windows", len(engine.failed))
+        if engine.failed:
+            _LOGGER.warning(
+                f"Could not fetch {len(engine.failed)} windows for {self.contract}"
+            )
+        return consumptions
+
+    async def import_old_consumptions(self, days: int = 365) -> None:
+        consumptions = await self.async_fetch_old_consumptions(days)
+        if consumptions:
+            await self._async_import_statistics(consumptions)
+
+    @property
+    def refining(self) -> bool:
+        """Whether the history is being imported in the background."""
+        return self.jobs is not None and self.jobs.pending(self.contract)
+
+    async def _async_queue_history(self) -> None:
+        """Import the history with a backfill job, resumed after a restart:
+        DAILY readings of the last year, then HOURLY ones of the last days."""
+        if self.jobs is None or self.refining:
+            return
+        _LOGGER.info(f"Importing the history of {self.contract} in the background")
+        await self.jobs.async_add(self.contract, BACKFILL_HISTORY_DAYS)
+
+    async def async_load_tariff(self) -> None:
+        """Fetch the invoices now if the tariff depends on them, so the
+        history is imported along with its cost."""
+        if self.tariff is None and self.facturas is not None:
+            if self.facturas.data is None:
+                await self.facturas.async_refresh()
+
+    async def async_import_window(
+        self, date_from, date_to, frequency: str = "DAILY"
+    ) -> bool:
+        """Import the readings of a window, both dates included.
+
+        Return False if the window could not be fetched.
+        """
+        engine = BackfillEngine(self._api, self.contract, frequency, workers=1)
+        readings = await engine.fetch([(date_from, date_to)])
+        if readings:
+            await self._async_import_statistics(readings)
+            if frequency == "HOURLY":
+                self.history.extend(readings)
+        return not engine.failed
+
+
+class CuentaAgua(TimestampDataUpdateCoordinator):
+    """Refresh all the contracts of an account in one cycle.
+
+    Consumptions are requested concurrently, up to `concurrency` contracts at
+    a time and `timeout` seconds each, then each contract imports its
+    statistics and notifies its entities. The interval until the next cycle
+    is chosen by the PollScheduler.
+    """
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        entry_id: str,
+        api: AsyncAiguesApiClient,
+        contratos: list[ContratoAgua],
+        concurrency: int = DEFAULT_REFRESH_CONCURRENCY,
+        timeout: int = DEFAULT_REFRESH_TIMEOUT,
+    ) -> None:
+        self._api = api
+        self.entry_id = entry_id
+        self.contratos = contratos
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.scheduler = PollScheduler(entry_id)
+        self._store = Store(hass, STORAGE_VERSION, f"{DOMAIN}.{entry_id}.scheduler")
+
+        super().__init__(
+            hass,
+            _LOGGER,
+            name=f"cuenta_{entry_id}",
+            update_interval=timedelta(seconds=DEFAULT_SCAN_PERIOD),
+        )
+
+    async def async_restore_scheduler(self) -> None:
+        self.scheduler.restore(await self._store.async_load() or {})
+
+    async def _async_update_contract(self, contrato: ContratoAgua) -> Optional[bool]:
+        """Fetch and process the readings of a contract within the deadline,
+        None if they did not change."""
+        if len(self.contratos) > 1:
+            # spread the requests of the account
+            await asyncio.sleep(random.uniform(0, SCHEDULER_CONTRACT_JITTER))
+        async with self._semaphore:
+            return await asyncio.wait_for(
+                self._async_fetch_and_process(contrato), self.timeout
+            )
+
+    @staticmethod
+    async def _async_fetch_and_process(contrato: ContratoAgua) -> Optional[bool]:
+        consumptions = await contrato.async_fetch_consumptions()
+        if consumptions is None:
+            return None
+        # may request more readings, to import the history or fill gaps
+        return await contrato.async_process_consumptions(consumptions)
+
+    async def _async_update_data(self):
+        with self._api.metrics.timer("poll"):
+            return await self._async_poll()
+
+    async def _async_poll(self):
+        _LOGGER.info(f"Updating data for {len(self.contratos)} contracts")
+        # check once for all contracts, and avoid expiring mid-cycle
+        if self._api.is_token_expired(TOKEN_REFRESH_MARGIN):
+            if await self._api.relogin():
+                async_save_token(self.hass, self.entry_id, self._api)
+        if self._api.is_token_expired():
+            _LOGGER.error("Token has expired, cannot check consumptions.")
+            raise ConfigEntryAuthFailed
+
+        results = await asyncio.gather(
+            *[self._async_update_contract(x) for x in self.contratos],
+            return_exceptions=True,
+        )
+
+        for result in results:
+            if isinstance(result, ConfigEntryAuthFailed):
+                raise result
+
+        for contrato, result in zip(self.contratos, results):
+            if isinstance(result, Exception):
+                contrato.async_set_update_error(result)
+                continue
+            if result is None:
+                # same readings, nothing to import or write
+                if not contrato.last_update_success:
+                    contrato.async_set_updated_data(contrato.data)
+                continue
+            contrato.async_set_updated_data(result)
+
+        await self._async_schedule_next(
+            throttled=any(
+                isinstance(x, (RateLimitedError, ConnectionFailedError))
+                for x in results
+            )
+        )
+        return True
+
+    async def _async_schedule_next(self, throttled: bool) -> None:
+        newest = [x.newest for x in self.contratos if x.newest]
+        self.update_interval = self.scheduler.update(
+            max(newest) if newest else None, throttled
+        )
+        _LOGGER.debug(
+            f"Next update in {self.update_interval}, "
+            f"expecting new readings at {self.scheduler.next_due()}"
+        )
+        await self._store.async_save(self.scheduler.as_dict())
+
+
+class FacturasAgua(TimestampDataUpdateCoordinator):
+    """Invoices and debt of a contract, refreshed once a day."""
+
+    def __init__(
+        self, hass: HomeAssistant, api: AsyncAiguesApiClient, contract: str
+    ) -> None:
+        self.contract = contract.upper()
+        self.id = contract.lower()
+        self.index = InvoiceIndex()
+        self._api = api
+        self._store = Store(hass, STORAGE_VERSION, f"{DOMAIN}.{self.id}.invoices")
+
+        super().__init__(
+            hass,
+            _LOGGER,
+            name=f"facturas_{self.id}",
+            update_interval=timedelta(seconds=INVOICE_SCAN_PERIOD),
+        )
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.contract}>"
+
+    async def async_restore(self) -> None:
+        stored = await self._store.async_load()
+        if stored:
+            self.index = InvoiceIndex.from_dict(stored)
+
+    async def _async_update_data(self):
+        months = self.index.months_to_fetch()
+        _LOGGER.info(f"Updating invoices of {self.contract}, last {months} months")
+        try:
+            invoices = await self._api.invoices(self.contract, last_months=months)
+            debt = await self._api.invoices_debt(self.contract)
+        except TokenRevokedError as exp:
+            raise ConfigEntryAuthFailed from exp
+        except Exception as exp:
+            raise UpdateFailed(f"Failed to fetch invoices: {exp}") from exp
+
+        added = self.index.add(invoices)
+        self.index.set_debt(debt)
+        if added:
+            _LOGGER.debug(f"Indexed {added} new invoices of {self.contract}")
+        await self._store.async_save(self.index.as_dict())
+        return self.index
+
+
+async def async_setup_coordinators(
+    hass: HomeAssistant, config_entry: ConfigEntry, api: AsyncAiguesApiClient
+) -> CuentaAgua:
+    """Create the coordinators of every contract and schedule the first
+    refresh."""
+    contratos = [
+        ContratoAgua(hass, api, contract)
+        for contract in config_entry.data[CONF_CONTRACT]
+    ]
+    tariff = TariffModel.parse(config_entry.options.get(CONF_TARIFF, ""))
+    for contrato in contratos:
+        contrato.tariff_config = tariff
+
+    cuenta = CuentaAgua(
+        hass,
+        config_entry.entry_id,
+        api,
+        contratos,
+        concurrency=config_entry.options.get(
+            CONF_REFRESH_CONCURRENCY, DEFAULT_REFRESH_CONCURRENCY
+        ),
+        timeout=config_entry.options.get(CONF_REFRESH_TIMEOUT, DEFAULT_REFRESH_TIMEOUT),
+    )
+    # show last known values while the first refresh is running
+    await asyncio.gather(
+        cuenta.async_restore_scheduler(),
+        *[x.async_restore_snapshot() for x in contratos],
+    )
+
+    # no entity listens to the account, keep the refresh scheduled
+    config_entry.async_on_unload(cuenta.async_add_listener(lambda: None))
+    for contrato in contratos:
+        config_entry.async_on_unload(contrato.async_flush)
+
+    return cuenta
+
+
+@callback
+def async_schedule_first_refresh(hass: HomeAssistant, cuenta: CuentaAgua) -> None:
+    """Refresh the account after startup, without waiting for it."""
+
+    # postpone first refresh to speed up startup
+    @callback
+    async def async_first_refresh(*args):
+        await cuenta.async_refresh()
+
+    if hass.state == CoreState.running:
+        # do not wait for the network, entities show the restored values
+        hass.async_create_task(async_first_refresh())
+    else:
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_START, async_first_refresh)
+
+
+async def async_setup_invoices(
+    hass: HomeAssistant, config_entry: ConfigEntry, api: AsyncAiguesApiClient
+) -> list[FacturasAgua]:
+    """Create the invoice coordinators, the index is refreshed after
+    startup."""
+    facturas = [
+        FacturasAgua(hass, api, contract)
+        for contract in config_entry.data[CONF_CONTRACT]
+    ]
+    await asyncio.gather(*[x.async_restore() for x in facturas])
+    for factura in facturas:
+        # calibrate the cost when no tariff is configured
+        hass.data[DOMAIN][factura.contract]["coordinator"].facturas = factura
+
+    @callback
+    async def async_first_refresh(*args):
+        for factura in facturas:
+            await factura.async_refresh()
+
+    if hass.state == CoreState.running:
+        hass.async_create_task(async_first_refresh())
+    else:
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_START, async_first_refresh)
+
+    return facturas
@@ -0,0 +1,83 @@
+"""Diagnostics support for Aigues de Barcelona."""
+
+from __future__ import annotations
+
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import CONF_PASSWORD
+from homeassistant.const import CONF_TOKEN
+from homeassistant.const import CONF_USERNAME
+from homeassistant.core import HomeAssistant
+
+from .const import CONF_CONTRACT
+from .const import DOMAIN
+from .jobs import JobQueue
+
+# contract numbers identify the account too
+TO_REDACT = {CONF_USERNAME, CONF_PASSWORD, CONF_TOKEN, CONF_CONTRACT}
+
+
+def _isoformat(value) -> str | None:
+    return value.isoformat() if value else None
+
+
+async def async_get_config_entry_diagnostics(
+    hass: HomeAssistant, entry: ConfigEntry
+) -> dict:
+    """Timings, counters and sync state of the config entry."""
+    data = hass.data[DOMAIN][entry.entry_id]
+    api = data["api"]
+    cuenta = data["account"]
+    expires_in = api.token.expires_in()
+
+    return {
+        "entry": {
+            "data": async_redact_data(entry.data, TO_REDACT),
+            "options": dict(entry.options),
+        },
+        "token": {
+            "expires_at": _isoformat(api.token.expires_at),
+            "expires_in": expires_in.total_seconds() if expires_in else None,
+        },
+        "metrics": api.metrics.as_dict(),
+        "cache": api.cache.stats if api.cache is not None else None,
+        "breaker": {
+            "open": api.breaker.is_open,
+            "failures": api.breaker.failures,
+            "retry_in": api.breaker.retry_in(),
+        },
+        "scheduler": {
+            **cuenta.scheduler.as_dict(),
+            "next_due": _isoformat(cuenta.scheduler.next_due()),
+            "update_interval": (
+                cuenta.update_interval.total_seconds()
+                if cuenta.update_interval
+                else None
+            ),
+            "last_update_success": cuenta.last_update_success,
+        },
+        # listed in the order of the entry, not keyed by number
+        "contracts": [
+            {
+                "last_update_success": contrato.last_update_success,
+                "last_exception": repr(contrato.last_exception),
+                "cursor": _isoformat(contrato._cursor),
+                "newest": _isoformat(contrato.newest),
+                "history_hours": len(contrato.history),
+                "tariff": contrato.tariff.format() if contrato.tariff else None,
+            }
+            for contrato in cuenta.contratos
+        ],
+        "invoices": [
+            {
+                "invoices": len(factura.index),
+                "newest": _isoformat(factura.index.newest),
+                "pending": len(factura.index.debt),
+            }
+            for factura in data.get("invoices", [])
+        ],
+        "jobs": async_redact_data(
+            [JobQueue.summary(x) for x in data["jobs"].jobs] if "jobs" in data else [],
+            TO_REDACT,
+        ),
+    }
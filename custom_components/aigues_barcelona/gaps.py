@@ -0,0 +1,73 @@
+"""Find the hours missing in the statistics and the requests to fill them."""
+
+from __future__ import annotations
+
+from collections.abc import Iterable
+from datetime import date
+from datetime import timedelta
+from datetime import tzinfo
+
+from .const import BACKFILL_WINDOW_DAYS
+from .const import GAPS_MERGE_DAYS
+from .history import from_epoch_hour
+
+
+def hour_ranges(hours: Iterable[int]) -> list[tuple[int, int]]:
+    """Compress epoch hours to sorted [start, end) ranges."""
+    ranges = list()
+    for hour in sorted(set(hours)):
+        if ranges and ranges[-1][1] == hour:
+            ranges[-1] = (ranges[-1][0], hour + 1)
+        else:
+            ranges.append((hour, hour + 1))
+    return ranges
+
+
+def missing_ranges(
+    present: Iterable[int],
+    start: int,
+    end: int,
+    skip: Iterable[tuple[int, int]] = (),
+) -> list[tuple[int, int]]:
+    """Ranges of epoch hours in [start, end) without a statistic.
+
+    Hours in the `skip` ranges count as present.
+    """
+    known = set(present)
+    for first, last in skip:
+        known.update(range(first, last))
+    return hour_ranges(x for x in range(start, end) if x not in known)
+
+
+def repair_windows(
+    ranges: list[tuple[int, int]],
+    tz: tzinfo,
+    merge_days: int = GAPS_MERGE_DAYS,
+    max_days: int = BACKFILL_WINDOW_DAYS,
+) -> list[tuple[date, date]]:
+    """Local date windows covering the ranges, both dates included.
+
+    The API is queried by whole days, up to `max_days` per request. Ranges
+    are requested together when that does not need another request, or
+    when they are at most `merge_days` apart.
+    """
+    windows = list()
+    for first, last in sorted(ranges):
+        date_from = from_epoch_hour(first).astimezone(tz).date()
+        date_to = from_epoch_hour(last - 1).astimezone(tz).date()
+        if windows:
+            start, end = windows[-1]
+            if (date_to - start).days < max_days or (
+                date_from - end
+            ).days <= merge_days:
+                windows[-1] = (start, max(end, date_to))
+                continue
+        windows.append((date_from, date_to))
+
+    split = list()
+    for start, end in windows:
+        while start <= end:
+            last = min(start + timedelta(days=max_days - 1), end)
+            split.append((start, last))
+            start = last + timedelta(days=1)
+    return split
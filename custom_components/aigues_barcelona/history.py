@@ -0,0 +1,206 @@
+"""Compact in-memory history of hourly consumptions, and the usage per
+period derived from it."""
+
+from __future__ import annotations
+
+from array import array
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from datetime import tzinfo
+
+from .const import HISTORY_MAX_HOURS
+
+
+def to_epoch_hour(value: datetime | str) -> int:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return int(value.timestamp()) // 3600
+
+
+def from_epoch_hour(hour: int) -> datetime:
+    return datetime.fromtimestamp(hour * 3600, tz=timezone.utc)
+
+
+class ConsumptionHistory:
+    """Ring buffer of (epoch hour, accumulated m3) readings.
+
+    Values are kept in `array` columns (int64 hours, float64 values) instead
+    of the API dicts. Appending the same hour again replaces its value, and
+    once `capacity` hours are stored the oldest reading is dropped. Readings
+    older than the last one are merged, which rebuilds the buffer.
+    """
+
+    def __init__(self, capacity: int = HISTORY_MAX_HOURS) -> None:
+        self.capacity = capacity
+        self._hours = array("q", [0]) * capacity
+        self._values = array("d", [0.0]) * capacity
+        self._start = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _pos(self, idx: int) -> int:
+        return (self._start + idx) % self.capacity
+
+    def hour(self, idx: int) -> int:
+        return self._hours[self._pos(idx)]
+
+    def value(self, idx: int) -> float:
+        return self._values[self._pos(idx)]
+
+    @property
+    def last(self) -> tuple[int, float] | None:
+        if not self._size:
+            return None
+        pos = self._pos(self._size - 1)
+        return self._hours[pos], self._values[pos]
+
+    def append(self, hour: int, value: float) -> bool:
+        """Add a reading, return False if it is older than the last one."""
+        if self._size:
+            pos = self._pos(self._size - 1)
+            if hour < self._hours[pos]:
+                return False
+            if hour == self._hours[pos]:
+                self._values[pos] = value
+                return True
+
+        if self._size == self.capacity:
+            pos = self._start
+            self._start = (self._start + 1) % self.capacity
+        else:
+            pos = self._pos(self._size)
+            self._size += 1
+        self._hours[pos] = hour
+        self._values[pos] = value
+        return True
+
+    def extend(
+        self, consumptions: list[dict], key: str = "accumulatedConsumption"
+    ) -> None:
+        """Add API readings, in any order."""
+        older = list()
+        for metric in consumptions:
+            hour = to_epoch_hour(metric["datetime"])
+            if not self.append(hour, metric[key]):
+                older.append((hour, metric[key]))
+        if older:
+            self._merge(older)
+
+    def _merge(self, readings: list[tuple[int, float]]) -> None:
+        hours = {self.hour(idx): self.value(idx) for idx in range(self._size)}
+        hours.update(readings)
+        newest = max(hours)
+        self._start = self._size = 0
+        for hour in sorted(hours):
+            # keep the retention window of the newest reading
+            if hour > newest - self.capacity:
+                self.append(hour, hours[hour])
+
+    def bisect(self, hour: int) -> int:
+        """Index of the first reading at or after `hour`."""
+        lo, hi = 0, self._size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.hour(mid) < hour:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def value_at(self, hour: int) -> float | None:
+        """Value of the last reading at or before `hour`."""
+        idx = self.bisect(hour + 1) - 1
+        return self.value(idx) if idx >= 0 else None
+
+    def between(self, start: datetime, end: datetime) -> list[tuple[datetime, float]]:
+        """Readings from `start` (included) to `end` (excluded)."""
+        first = self.bisect(to_epoch_hour(start))
+        last = self.bisect(to_epoch_hour(end))
+        return [
+            (from_epoch_hour(self.hour(idx)), self.value(idx))
+            for idx in range(first, last)
+        ]
+
+    def as_dict(self) -> dict:
+        return {
+            "hours": [self.hour(idx) for idx in range(self._size)],
+            "values": [self.value(idx) for idx in range(self._size)],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> ConsumptionHistory:
+        history = cls()
+        for hour, value in zip(data.get("hours", []), data.get("values", [])):
+            history.append(hour, value)
+        return history
+
+
+class ConsumptionAggregates:
+    """Usage per period, read from the history.
+
+    The meter reports an accumulated value, so the usage of the current day,
+    week and month is the difference with the last value before the period
+    started. Periods are the ones of the last reading in `tz`, which is
+    usually one or two days behind.
+    """
+
+    def __init__(self, history: ConsumptionHistory, tz: tzinfo = timezone.utc):
+        self.history = history
+        self.tz = tz
+
+    @property
+    def last_time(self) -> datetime | None:
+        if not self.history:
+            return None
+        return from_epoch_hour(self.history.last[0]).astimezone(self.tz)
+
+    @property
+    def last_value(self) -> float | None:
+        if not self.history:
+            return None
+        return self.history.last[1]
+
+    @property
+    def last_hour(self) -> float | None:
+        """Usage of the last hour, if the previous one has a reading."""
+        history = self.history
+        last = len(history) - 1
+        if last < 1 or history.hour(last) - history.hour(last - 1) != 1:
+            return None
+        return round(max(history.value(last) - history.value(last - 1), 0.0), 4)
+
+    def _period_start(self, period: str) -> datetime | None:
+        day = self.last_time.replace(hour=0, minute=0, second=0, microsecond=0)
+        if period == "today":
+            return day
+        if period == "week":
+            return day - timedelta(days=day.weekday())
+        if period == "month":
+            return day.replace(day=1)
+        return None
+
+    def _usage_since(self, hour: int) -> float:
+        baseline = self.history.value_at(hour)
+        if baseline is None:
+            # the history does not reach it
+            baseline = self.history.value(0)
+        return self.last_value - baseline
+
+    def usage(self, period: str) -> float | None:
+        if not self.history:
+            return None
+        start = self._period_start(period)
+        if start is None:
+            return None
+        return round(self._usage_since(to_epoch_hour(start) - 1), 4)
+
+    @property
+    def flow_24h(self) -> float | None:
+        """Average flow of the last 24 hours, in m3/h."""
+        if not self.history:
+            return None
+        usage = self._usage_since(self.history.last[0] - 24)
+        return round(max(usage, 0.0) / 24, 6)
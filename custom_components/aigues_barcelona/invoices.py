@@ -0,0 +1,147 @@
+"""Persisted index of the invoices of a contract."""
+
+from __future__ import annotations
+
+from datetime import date
+from datetime import datetime
+
+from .const import INVOICE_HISTORY_MONTHS
+
+# the first key present is used
+FIELD_NUMBER = ("invoiceNumber", "number", "invoiceId")
+FIELD_DATE = ("invoiceDate", "issueDate", "date")
+FIELD_AMOUNT = ("totalAmount", "amount", "invoiceAmount")
+FIELD_PENDING = ("pendingAmount", "debtAmount")
+FIELD_CONSUMPTION = ("consumption", "totalConsumption", "billedConsumption")
+
+
+def _field(invoice: dict, keys: tuple):
+    for key in keys:
+        if invoice.get(key) is not None:
+            return invoice[key]
+    return None
+
+
+def _number(invoice: dict, keys: tuple) -> float | None:
+    value = _field(invoice, keys)
+    if isinstance(value, str):
+        value = value.replace(",", ".")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _date(invoice: dict) -> date | None:
+    value = _field(invoice, FIELD_DATE)
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.fromisoformat(value).date()
+    except ValueError:
+        pass
+    for fmt in ("%d/%m/%Y", "%d-%m-%Y"):
+        try:
+            return datetime.strptime(value[:10], fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+class InvoiceIndex:
+    """Invoices keyed by invoice number, plus the ones pending to pay.
+
+    Invoices are immutable once issued, so only the months after the newest
+    indexed invoice need to be requested again.
+    """
+
+    def __init__(self) -> None:
+        self.invoices: dict[str, dict] = dict()
+        self.debt: list[dict] = list()
+
+    def __len__(self) -> int:
+        return len(self.invoices)
+
+    def add(self, invoices: list[dict] | None) -> int:
+        """Index the invoices, return how many were new."""
+        added = 0
+        for invoice in invoices or []:
+            number = _field(invoice, FIELD_NUMBER)
+            if number is None:
+                continue
+            if str(number) not in self.invoices:
+                added += 1
+            self.invoices[str(number)] = invoice
+        return added
+
+    def set_debt(self, invoices: list[dict] | None) -> None:
+        self.debt = list(invoices or [])
+
+    def _sorted(self) -> list[tuple[date, dict]]:
+        dated = [(_date(x), x) for x in self.invoices.values()]
+        return sorted(
+            [x for x in dated if x[0] is not None], key=lambda x: x[0], reverse=True
+        )
+
+    @property
+    def newest(self) -> date | None:
+        ordered = self._sorted()
+        return ordered[0][0] if ordered else None
+
+    @property
+    def last(self) -> dict | None:
+        ordered = self._sorted()
+        return ordered[0][1] if ordered else None
+
+    def months_to_fetch(self, today: date | None = None) -> int:
+        """Months to request so the newest invoice is included again."""
+        newest = self.newest
+        if newest is None:
+            return INVOICE_HISTORY_MONTHS
+        today = today or date.today()
+        months = (today.year - newest.year) * 12 + today.month - newest.month + 1
+        return min(max(months, 1), INVOICE_HISTORY_MONTHS)
+
+    @property
+    def last_amount(self) -> float | None:
+        last = self.last
+        return _number(last, FIELD_AMOUNT) if last else None
+
+    @property
+    def outstanding(self) -> float:
+        total = 0.0
+        for invoice in self.debt:
+            amount = _number(invoice, FIELD_PENDING)
+            if amount is None:
+                amount = _number(invoice, FIELD_AMOUNT)
+            total += amount or 0.0
+        return round(total, 2)
+
+    def cost_per_m3(self, months: int = 12) -> float | None:
+        """Billed amount over billed m3 of the invoices of the last months."""
+        newest = self.newest
+        if newest is None:
+            return None
+        amount = consumption = 0.0
+        for when, invoice in self._sorted():
+            if (newest.year - when.year) * 12 + newest.month - when.month >= months:
+                break
+            value = _number(invoice, FIELD_AMOUNT)
+            used = _number(invoice, FIELD_CONSUMPTION)
+            if value is None or not used:
+                continue
+            amount += value
+            consumption += used
+        if not consumption:
+            return None
+        return round(amount / consumption, 4)
+
+    def as_dict(self) -> dict:
+        return {"invoices": self.invoices, "debt": self.debt}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> InvoiceIndex:
+        index = cls()
+        index.invoices = dict(data.get("invoices", {}))
+        index.debt = list(data.get("debt", []))
+        return index
@@ -0,0 +1,292 @@
+"""Persistent queue of history backfill jobs."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import uuid
+from datetime import date
+from datetime import timedelta
+
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import EVENT_HOMEASSISTANT_START
+from homeassistant.core import callback
+from homeassistant.core import CoreState
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.dispatcher import async_dispatcher_send
+from homeassistant.helpers.storage import Store
+from homeassistant.util import dt as dt_util
+
+from .api import AsyncAiguesApiClient
+from .backfill import split_windows
+from .const import BACKFILL_DAILY_WINDOW_DAYS
+from .const import BACKFILL_REFINE_DAYS
+from .const import BACKFILL_WINDOW_DAYS
+from .const import DOMAIN
+from .const import EVENT_BACKFILL_PROGRESS
+from .const import JOBS_HISTORY
+from .const import JOBS_WINDOW_DELAY
+from .const import STORAGE_VERSION
+from .coordinator import create_background_task
+from .coordinator import CuentaAgua
+
+_LOGGER = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_CANCELLED = "cancelled"
+ACTIVE = (JOB_QUEUED, JOB_RUNNING)
+
+
+def job_windows(days: int, today: date | None = None) -> list[list]:
+    """Windows to import the last `days`: DAILY ranges for the whole period,
+    then HOURLY weeks for the recent days, newest first."""
+    today = today or date.today()
+    start = today - timedelta(days=days)
+    windows = [
+        [x.isoformat(), y.isoformat(), "DAILY"]
+        for x, y in split_windows(start, today, BACKFILL_DAILY_WINDOW_DAYS)
+    ]
+    recent = max(start, today - timedelta(days=BACKFILL_REFINE_DAYS))
+    windows += [
+        [x.isoformat(), y.isoformat(), "HOURLY"]
+        for x, y in reversed(split_windows(recent, today, BACKFILL_WINDOW_DAYS))
+    ]
+    return windows
+
+
+def signal_jobs(entry_id: str) -> str:
+    return f"{DOMAIN}_{entry_id}_jobs"
+
+
+class JobQueue:
+    """Backfill jobs of the contracts of a config entry.
+
+    Jobs run one at a time, a window after another. The queue is saved
+    after every window, so jobs interrupted by a restart continue from the
+    last completed window. Progress is sent with a dispatcher signal and
+    the EVENT_BACKFILL_PROGRESS event.
+    """
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        entry_id: str,
+        api: AsyncAiguesApiClient,
+        contratos: list,
+        on_done=None,
+    ) -> None:
+        self.hass = hass
+        self.entry_id = entry_id
+        self._api = api
+        self.contratos = {x.contract: x for x in contratos}
+        self.jobs: list[dict] = list()
+        self._store = Store(hass, STORAGE_VERSION, f"{DOMAIN}.{entry_id}.jobs")
+        self._task: asyncio.Task | None = None
+        # awaited after a job is done, e.g. to refresh with the new cursor
+        self._on_done = on_done
+
+    async def async_load(self) -> None:
+        stored = await self._store.async_load() or {}
+        self.jobs = [
+            x for x in stored.get("jobs", []) if x["contract"] in self.contratos
+        ]
+        for job in self.jobs:
+            if job["state"] == JOB_RUNNING:
+                job["state"] = JOB_QUEUED
+        resumed = [x for x in self.jobs if x["state"] == JOB_QUEUED]
+        if resumed:
+            _LOGGER.info(f"Resuming {len(resumed)} backfill jobs")
+
+    async def _async_save(self) -> None:
+        finished = [x for x in self.jobs if x["state"] not in ACTIVE]
+        for job in finished[:-JOBS_HISTORY]:
+            self.jobs.remove(job)
+        await self._store.async_save({"jobs": self.jobs})
+
+    @property
+    def active(self) -> list[dict]:
+        return [x for x in self.jobs if x["state"] in ACTIVE]
+
+    def pending(self, contract: str) -> bool:
+        """Whether `contract` has a job queued or running."""
+        return any(x["contract"] == contract for x in self.active)
+
+    @property
+    def progress(self) -> float | None:
+        """Percentage of windows completed of the active jobs."""
+        active = self.active
+        if not active:
+            return 100.0 if self.jobs else None
+        total = sum(x["total"] for x in active)
+        done = sum(x["total"] - len(x["windows"]) for x in active)
+        return round(100 * done / total, 1) if total else 100.0
+
+    @staticmethod
+    def summary(job: dict) -> dict:
+        return {
+            "id": job["id"],
+            "contract": job["contract"],
+            "state": job["state"],
+            "done": job["total"] - len(job["windows"]),
+            "total": job["total"],
+            "failed": len(job["failed"]),
+        }
+
+    @callback
+    def _async_notify(self, job: dict) -> None:
+        async_dispatcher_send(self.hass, signal_jobs(self.entry_id))
+        self.hass.bus.async_fire(EVENT_BACKFILL_PROGRESS, self.summary(job))
+
+    async def async_add(self, contract: str | None = None, days: int = 365) -> list:
+        """Queue a job per contract, or for `contract` only, return their
+        ids."""
+        contracts = list(self.contratos)
+        if contract is not None:
+            contracts = [x for x in contracts if x == contract.upper()]
+
+        ids = list()
+        for number in contracts:
+            # replaces the job pending for the same contract
+            for job in self.active:
+                if job["contract"] == number:
+                    job["state"] = JOB_CANCELLED
+            windows = job_windows(days)
+            job = {
+                "id": uuid.uuid4().hex[:8],
+                "contract": number,
+                "days": days,
+                "created": dt_util.utcnow().isoformat(),
+                "state": JOB_QUEUED,
+                "windows": windows,
+                "total": len(windows),
+                "failed": [],
+            }
+            self.jobs.append(job)
+            ids.append(job["id"])
+            self._async_notify(job)
+
+        await self._async_save()
+        self.async_start()
+        return ids
+
+    async def async_cancel(
+        self, contract: str | None = None, job_id: str | None = None
+    ) -> int:
+        """Cancel the active jobs, of `contract` or with `job_id` if given."""
+        cancelled = 0
+        for job in self.active:
+            if contract is not None and job["contract"] != contract.upper():
+                continue
+            if job_id is not None and job["id"] != job_id:
+                continue
+            # a running job stops after its current window
+            job["state"] = JOB_CANCELLED
+            cancelled += 1
+            self._async_notify(job)
+        await self._async_save()
+        return cancelled
+
+    @callback
+    def async_start(self) -> None:
+        """Run the queued jobs in the background, if not running yet."""
+        if self._task is not None and not self._task.done():
+            return
+        if not self.active:
+            return
+        self._task = create_background_task(
+            self.hass, self._async_run(), f"{DOMAIN} backfill {self.entry_id}"
+        )
+
+    async def async_stop(self) -> None:
+        """Stop running, jobs continue from their last window next time."""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _async_run(self) -> None:
+        while self.active:
+            job = self.active[0]
+            contrato = self.contratos[job["contract"]]
+            if self._api.is_token_expired():
+                _LOGGER.warning("Token has expired, backfill jobs are paused")
+                return
+            try:
+                await self._async_run_job(job, contrato)
+            finally:
+                if job["state"] == JOB_RUNNING:
+                    # interrupted, continue on the next start
+                    job["state"] = JOB_QUEUED
+
+    async def _async_run_job(self, job: dict, contrato) -> None:
+        _LOGGER.info(f"Running backfill job {job['id']} of {job['contract']}")
+        job["state"] = JOB_RUNNING
+        self._async_notify(job)
+        # on the first install, the invoices may not be loaded yet
+        await contrato.async_load_tariff()
+
+        while job["windows"] and job["state"] == JOB_RUNNING:
+            date_from, date_to, frequency = job["windows"][0]
+            try:
+                fetched = await contrato.async_import_window(
+                    date.fromisoformat(date_from),
+                    date.fromisoformat(date_to),
+                    frequency,
+                )
+            except Exception as exp:
+                _LOGGER.warning(f"Failed to import {date_from} - {date_to}: {exp}")
+                fetched = False
+            if not fetched:
+                job["failed"].append(job["windows"][0])
+            job["windows"].pop(0)
+            await self._async_save()
+            self._async_notify(job)
+            if job["windows"]:
+                await asyncio.sleep(JOBS_WINDOW_DELAY)
+
+        if job["state"] == JOB_RUNNING:
+            job["state"] = JOB_DONE
+            _LOGGER.info(
+                f"Backfill job {job['id']} of {job['contract']} done, "
+                f"{len(job['failed'])} windows failed"
+            )
+            await self._async_save()
+            self._async_notify(job)
+            if self._on_done is not None:
+                await self._on_done()
+
+
+async def async_setup_jobs(
+    hass: HomeAssistant,
+    config_entry: ConfigEntry,
+    api: AsyncAiguesApiClient,
+    cuenta: CuentaAgua,
+) -> JobQueue:
+    """Create the job queue, the interrupted jobs continue after startup."""
+    queue = JobQueue(
+        hass,
+        config_entry.entry_id,
+        api,
+        cuenta.contratos,
+        on_done=cuenta.async_request_refresh,
+    )
+    await queue.async_load()
+    for contrato in cuenta.contratos:
+        contrato.jobs = queue
+    config_entry.async_on_unload(queue.async_stop)
+
+    @callback
+    def async_resume(*args) -> None:
+        queue.async_start()
+
+    if hass.state == CoreState.running:
+        async_resume()
+    else:
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_START, async_resume)
+
+    return queue
@@ -0,0 +1,104 @@
+"""In-memory timings and counters of the poll and backfill paths."""
+
+from __future__ import annotations
+
+import contextlib
+import time
+from bisect import bisect_left
+from collections import deque
+
+from .const import METRICS_BUCKETS
+from .const import METRICS_SAMPLES
+
+
+class Histogram:
+    """Distribution of a value with fixed bucket bounds.
+
+    Bucket counts and totals grow with the number of observations, not the
+    memory. Percentiles are taken from the last `samples` observations.
+    """
+
+    def __init__(
+        self, bounds: tuple = METRICS_BUCKETS, samples: int = METRICS_SAMPLES
+    ) -> None:
+        self.bounds = bounds
+        # last bucket counts the values above every bound
+        self.buckets = [0] * (len(bounds) + 1)
+        self.recent: deque[float] = deque(maxlen=samples)
+        self.count = 0
+        self.total = 0.0
+        self.min: float | None = None
+        self.max: float | None = None
+
+    def observe(self, value: float) -> None:
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.recent.append(value)
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    @property
+    def last(self) -> float | None:
+        return self.recent[-1] if self.recent else None
+
+    def percentile(self, q: float) -> float | None:
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def as_dict(self) -> dict:
+        buckets = {f"le_{x:g}": n for x, n in zip(self.bounds, self.buckets)}
+        buckets["inf"] = self.buckets[-1]
+        values = {
+            "sum": self.total,
+            "min": self.min,
+            "max": self.max,
+            "last": self.last,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+        }
+        return {
+            "count": self.count,
+            **{k: round(v, 6) if v is not None else None for k, v in values.items()},
+            "buckets": buckets,
+        }
+
+
+class Metrics:
+    """Named histograms and counters, created on first use.
+
+    Histogram names are stage names such as `request.consumptions`,
+    `parse` or `import`, in seconds unless stated otherwise.
+    """
+
+    def __init__(self) -> None:
+        self.histograms: dict[str, Histogram] = dict()
+        self.counters: dict[str, int] = dict()
+
+    def histogram(self, name: str) -> Histogram:
+        if name not in self.histograms:
+            self.histograms[name] = Histogram()
+        return self.histograms[name]
+
+    def observe(self, name: str, value: float) -> None:
+        self.histogram(name).observe(value)
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextlib.contextmanager
+    def timer(self, name: str):
+        """Observe the seconds spent in the block, also if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def as_dict(self) -> dict:
+        return {
+            "histograms": {k: v.as_dict() for k, v in self.histograms.items()},
+            "counters": dict(self.counters),
+        }
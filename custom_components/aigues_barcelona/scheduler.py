@@ -0,0 +1,120 @@
+"""Adaptive polling, following when the API publishes new readings."""
+
+from __future__ import annotations
+
+import zlib
+from collections import deque
+from datetime import datetime
+from datetime import timedelta
+
+from homeassistant.util import dt as dt_util
+
+from .const import SCHEDULER_JITTER
+from .const import SCHEDULER_MAX_INTERVAL
+from .const import SCHEDULER_MIN_INTERVAL
+from .const import SCHEDULER_SAMPLES
+from .const import SCHEDULER_THROTTLE_INTERVAL
+
+
+def _median(values) -> float:
+    ordered = sorted(values)
+    return ordered[len(ordered) // 2]
+
+
+class PollScheduler:
+    """Choose the interval until the next poll.
+
+    Readings are published in batches, some hours after they are measured.
+    Each time the newest reading advances, the scheduler records how much it
+    advanced (the batch step) and how late it was published (the lag,
+    halfway between the last poll without it and the poll that got it), so
+    the next batch is expected at `newest + step + lag`. Until then
+    there is nothing to fetch; once due, polls start at
+    SCHEDULER_MIN_INTERVAL and back off while nothing changes. Throttling
+    backs off faster. A fixed offset per config entry spreads the polls of
+    different installs.
+    """
+
+    def __init__(self, key: str) -> None:
+        self.jitter = zlib.crc32(key.encode()) % (SCHEDULER_JITTER + 1)
+        self.newest: datetime | None = None
+        self.last_poll: datetime | None = None
+        self._lags: deque[float] = deque(maxlen=SCHEDULER_SAMPLES)
+        self._steps: deque[float] = deque(maxlen=SCHEDULER_SAMPLES)
+        self._backoff = SCHEDULER_MIN_INTERVAL
+
+    @property
+    def lag(self) -> float | None:
+        """Usual publication lag, in seconds."""
+        return _median(self._lags) if self._lags else None
+
+    @property
+    def step(self) -> float:
+        """Usual advance of the newest reading per batch, in seconds."""
+        return _median(self._steps) if self._steps else 3600.0
+
+    def next_due(self) -> datetime | None:
+        """When the next batch of readings should be available."""
+        if self.newest is None or self.lag is None:
+            return None
+        return self.newest + timedelta(seconds=self.step + self.lag)
+
+    def _crossed_due(self, now: datetime) -> bool:
+        due = self.next_due()
+        return (
+            due is not None
+            and self.last_poll is not None
+            and self.last_poll < due <= now
+        )
+
+    def update(
+        self,
+        newest: datetime | None,
+        throttled: bool = False,
+        now: datetime | None = None,
+    ) -> timedelta:
+        """Record the result of a poll, return the interval until the next
+        one. `newest` is the datetime of the most recent reading."""
+        now = now or dt_util.utcnow()
+
+        if throttled:
+            self._backoff = min(
+                max(self._backoff * 2, SCHEDULER_THROTTLE_INTERVAL),
+                SCHEDULER_MAX_INTERVAL,
+            )
+        elif newest is not None and (self.newest is None or newest > self.newest):
+            # published after the previous poll and the reading itself
+            since = max(self.last_poll or newest, newest)
+            seen = since + (now - since) / 2
+            self._lags.append((seen - newest).total_seconds())
+            if self.newest is not None:
+                self._steps.append((newest - self.newest).total_seconds())
+            self.newest = newest
+            self._backoff = SCHEDULER_MIN_INTERVAL
+        elif self._crossed_due(now):
+            # the batch is due now, poll often until it arrives
+            self._backoff = SCHEDULER_MIN_INTERVAL
+        else:
+            self._backoff = min(self._backoff * 2, SCHEDULER_MAX_INTERVAL)
+        self.last_poll = now
+
+        seconds = self._backoff
+        due = self.next_due()
+        if not throttled and due is not None and due > now:
+            # nothing new until then
+            seconds = max(seconds, (due - now).total_seconds())
+        seconds = min(max(seconds, SCHEDULER_MIN_INTERVAL), SCHEDULER_MAX_INTERVAL)
+        return timedelta(seconds=seconds + self.jitter)
+
+    def as_dict(self) -> dict:
+        return {
+            "newest": self.newest.isoformat() if self.newest else None,
+            "lags": list(self._lags),
+            "steps": list(self._steps),
+        }
+
+    def restore(self, data: dict) -> None:
+        if data.get("newest"):
+            self.newest = dt_util.as_utc(datetime.fromisoformat(data["newest"]))
+        self._lags.extend(data.get("lags", []))
+        self._steps.extend(data.get("steps", []))
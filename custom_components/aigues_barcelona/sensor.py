@@ -3,322 +3,274 @@
 # from __future__ import annotations
 import logging
 from datetime import datetime
-from datetime import timedelta
-
-import homeassistant.components.recorder.util as recorder_util
-
-try:
-    from homeassistant.components.recorder.const import (
-        DATA_INSTANCE as RECORDER_DATA_INSTANCE,
-    )
-except ImportError:  # NEW Home Assistant 2024.08
-    from homeassistant.helpers.recorder import (
-        DATA_INSTANCE as RECORDER_DATA_INSTANCE,
-    )
-from homeassistant.components.recorder.statistics import async_import_statistics
-from homeassistant.components.recorder.statistics import clear_statistics
-from homeassistant.components.recorder.statistics import list_statistic_ids
+
 from homeassistant.components.sensor import SensorDeviceClass
 from homeassistant.components.sensor import SensorEntity
 from homeassistant.components.sensor import SensorStateClass
-from homeassistant.const import CONF_PASSWORD
 from homeassistant.const import CONF_STATE
-from homeassistant.const import CONF_TOKEN
-from homeassistant.const import CONF_USERNAME
-from homeassistant.const import EVENT_HOMEASSISTANT_START
+from homeassistant.const import CURRENCY_EURO
+from homeassistant.const import EntityCategory
+from homeassistant.const import PERCENTAGE
+from homeassistant.const import UnitOfTime
 from homeassistant.const import UnitOfVolume
+from homeassistant.const import UnitOfVolumeFlowRate
 from homeassistant.core import callback
-from homeassistant.core import CoreState
 from homeassistant.core import HomeAssistant
-from homeassistant.exceptions import ConfigEntryAuthFailed
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
 from homeassistant.helpers.update_coordinator import CoordinatorEntity
-from homeassistant.helpers.update_coordinator import TimestampDataUpdateCoordinator
 
-from .api import AiguesApiClient
-from .const import API_ERROR_TOKEN_REVOKED
 from .const import ATTR_LAST_MEASURE
-from .const import CONF_CONTRACT
 from .const import CONF_VALUE
-from .const import DEFAULT_SCAN_PERIOD
 from .const import DOMAIN
-
-from typing import Optional
+from .jobs import JobQueue
+from .jobs import signal_jobs
 
 _LOGGER = logging.getLogger(__name__)
 
-
-def get_db_instance(hass):
-    """Workaround for older HA versions."""
-    try:
-        return recorder_util.get_instance(hass)
-    except AttributeError:
-        return hass
+# key: (name, icon)
+CONSUMO_SENSORS = {
+    "last_hour": ("Consumo ultima hora", "mdi:water"),
+    "today": ("Consumo dia", "mdi:water"),
+    "week": ("Consumo semana", "mdi:water"),
+    "month": ("Consumo mes", "mdi:water"),
+    "flow_24h": ("Caudal 24h", "mdi:water-sync"),
+}
+
+# key: (name, icon)
+FACTURA_SENSORS = {
+    "last_amount": ("Ultima factura", "mdi:receipt-text"),
+    "debt": ("Deuda", "mdi:cash-clock"),
+    "cost_m3": ("Coste m3", "mdi:cash"),
+}
+
+# key: (name, icon), disabled by default
+DIAGNOSTICO_SENSORS = {
+    "api_latency": ("Latencia API", "mdi:timer-outline"),
+    "poll_duration": ("Duracion actualizacion", "mdi:timer-sync-outline"),
+    "import_duration": ("Duracion importacion", "mdi:database-clock"),
+    "rate_limited": ("Peticiones limitadas", "mdi:speedometer-slow"),
+    "token_expiry": ("Caducidad token", "mdi:key-chain"),
+}
 
 
 async def async_setup_entry(hass: HomeAssistant, config_entry, async_add_entities):
     """Set up entry."""
-    hass.data.setdefault(DOMAIN, {})
-
     _LOGGER.info("calling async_setup_entry")
 
-    username = config_entry.data[CONF_USERNAME]
-    password = config_entry.data[CONF_PASSWORD]
-    contracts = config_entry.data[CONF_CONTRACT]
-    token = config_entry.data.get(CONF_TOKEN)
+    cuenta = hass.data[DOMAIN][config_entry.entry_id]["account"]
 
-    contadores = list()
-
-    for contract in contracts:
-        coordinator = ContratoAgua(hass, username, password, contract, token=token)
-        contadores.append(ContadorAgua(coordinator))
-
-    # postpone first refresh to speed up startup
-    @callback
-    async def async_first_refresh(*args):
-        for sensor in contadores:
-            await sensor.coordinator.async_refresh()
-
-    # ------
-
-    if hass.state == CoreState.running:
-        await async_first_refresh()
-    else:
-        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_START, async_first_refresh)
+    contadores = [ContadorAgua(x) for x in cuenta.contratos]
 
     _LOGGER.info("about to add entities")
-    async_add_entities(contadores)
+    consumos = [
+        ConsumoAgua(x.coordinator, key) for x in contadores for key in CONSUMO_SENSORS
+    ]
+    facturas = [
+        FacturaAgua(x, key)
+        for x in hass.data[DOMAIN][config_entry.entry_id]["invoices"]
+        for key in FACTURA_SENSORS
+    ]
+    diagnosticos = [DiagnosticoAgua(cuenta, key) for key in DIAGNOSTICO_SENSORS]
+    progreso = ProgresoAgua(hass.data[DOMAIN][config_entry.entry_id]["jobs"])
+    async_add_entities(contadores + consumos + facturas + diagnosticos + [progreso])
 
     return True
 
 
-class ContratoAgua(TimestampDataUpdateCoordinator):
-    def __init__(
-        self,
-        hass: HomeAssistant,
-        username: str,
-        password: str,
-        contract: str,
-        token: str = None,
-        prev_data=None,
-    ) -> None:
-        """Initialize the data handler."""
-        self.reset = prev_data is None
-
-        self.contract = contract.upper()
-        self.id = contract.lower()
-        self.internal_sensor_id = f"sensor.contador_{self.id}"
-
-        if not hass.data[DOMAIN].get(self.contract):
-            # init data shared store
-            hass.data[DOMAIN][self.contract] = {}
-
-        # create alias
-        self._data = hass.data[DOMAIN][self.contract]
-
-        # WARN define a pointer to this object
-        hass.data[DOMAIN][self.contract]["coordinator"] = self
-
-        # the api object
-        self._api = AiguesApiClient(username, password, contract)
-        if token:
-            self._api.set_token(token)
-
-        super().__init__(
-            hass,
-            _LOGGER,
-            name=self.id,
-            update_interval=timedelta(seconds=DEFAULT_SCAN_PERIOD),
-        )
-
-    def __repr__(self):
-        return f"<{self.__class__.__name__} {self.contract}>"
+class ContadorAgua(CoordinatorEntity, SensorEntity):
+    """Representation of a sensor."""
 
-    async def _async_update_data(self):
-        _LOGGER.info(f"Updating coordinator data for {self.contract}")
-        TODAY = datetime.now()
-        LAST_WEEK = TODAY - timedelta(days=7)
-        LAST_TIME_DAYS = None
+    def __init__(self, coordinator) -> None:
+        """Initialize the sensor."""
+        super().__init__(coordinator)
+        self._attr_name = f"Contador {coordinator.id}"
+        self._attr_unique_id = coordinator.id
+        self._attr_icon = "mdi:water-pump"
+        self._attr_has_entity_name = True
+        self._attr_should_poll = False
+        self._attr_device_class = SensorDeviceClass.WATER
+        self._attr_state_class = SensorStateClass.TOTAL
+        self._attr_native_unit_of_measurement = UnitOfVolume.CUBIC_METERS
 
-        # last_measurement = await self.get_last_measurement_stored()
-        # _LOGGER.info("Last stored measurement: %s", last_measurement)
+    @property
+    def native_value(self):
+        return self.coordinator._data.get(CONF_VALUE, None)
 
+    @property
+    def last_measurement(self):
         try:
-            previous = datetime.fromisoformat(self._data.get(CONF_STATE, ""))
-            # FIX: TypeError: can't subtract offset-naive and offset-aware datetimes
-            previous = previous.replace(tzinfo=None)
-            if previous:
-                LAST_TIME_DAYS = (TODAY - previous).days
+            last_measure = datetime.fromisoformat(
+                self.coordinator._data.get(CONF_STATE, "")
+            )
         except ValueError:
-            previous = None
-
-        if previous and (TODAY - previous) <= timedelta(minutes=60):
-            _LOGGER.warning("Skipping request update data - too early")
-            return
+            last_measure = None
+        return last_measure
 
-        consumptions = None
-        try:
-            if self._api.is_token_expired():
-                raise ConfigEntryAuthFailed
-            # TODO: change once recaptcha is fiexd
-            # await self.hass.async_add_executor_job(self._api.login)
-            consumptions = await self.hass.async_add_executor_job(
-                self._api.consumptions, LAST_WEEK, TODAY, self.contract
-            )
-        except ConfigEntryAuthFailed as exp:
-            _LOGGER.error("Token has expired, cannot check consumptions.")
-            raise ConfigEntryAuthFailed from exp
-        except Exception as exp:
-            self.async_set_update_error(exp)
-            if API_ERROR_TOKEN_REVOKED in str(exp):
-                raise ConfigEntryAuthFailed from exp
-
-        if not consumptions:
-            _LOGGER.error("No consumptions available")
-            return False
-
-        self._data["consumptions"] = consumptions
-
-        # get last entry - most updated
-        metric = consumptions[-1]
-        self._data[CONF_VALUE] = metric["accumulatedConsumption"]
-        self._data[CONF_STATE] = metric["datetime"]
-
-        # await self._clear_statistics()
-        try:
-            await self._async_import_statistics(consumptions)
-        except:
-            pass
+    @property
+    def extra_state_attributes(self):
+        attrs = {ATTR_LAST_MEASURE: self.last_measurement}
+        return attrs
 
-        if LAST_TIME_DAYS and LAST_TIME_DAYS >= 7:
-            await self.import_old_consumptions(days=LAST_TIME_DAYS)
 
-        return True
+class ConsumoAgua(CoordinatorEntity, SensorEntity):
+    """Usage derived from the readings, see ConsumptionAggregates."""
 
-    async def _clear_statistics(self) -> None:
-        all_ids = await get_db_instance(self.hass).async_add_executor_job(
-            list_statistic_ids, self.hass
-        )
-        to_clear = [
-            x["statistic_id"]
-            for x in all_ids
-            if x["statistic_id"].startswith(self.internal_sensor_id)
-        ]
-
-        if to_clear:
-            _LOGGER.warn(
-                f"About to delete {len(to_clear)} entries from {self.contract}"
-            )
-            # NOTE: This does not seem to work?
-            await get_db_instance(self.hass).async_add_executor_job(
-                clear_statistics, self.hass.data[RECORDER_DATA_INSTANCE], to_clear
+    def __init__(self, coordinator, key: str) -> None:
+        """Initialize the sensor."""
+        super().__init__(coordinator)
+        name, icon = CONSUMO_SENSORS[key]
+        self._key = key
+        self._attr_name = f"{name} {coordinator.id}"
+        self._attr_unique_id = f"{coordinator.id}_{key}"
+        self._attr_icon = icon
+        self._attr_has_entity_name = True
+        self._attr_should_poll = False
+        if key == "flow_24h":
+            self._attr_state_class = SensorStateClass.MEASUREMENT
+            self._attr_native_unit_of_measurement = (
+                UnitOfVolumeFlowRate.CUBIC_METERS_PER_HOUR
             )
+        else:
+            self._attr_device_class = SensorDeviceClass.WATER
+            self._attr_native_unit_of_measurement = UnitOfVolume.CUBIC_METERS
+            if key != "last_hour":
+                self._attr_state_class = SensorStateClass.TOTAL_INCREASING
 
-    async def get_last_measurement_stored(self) -> Optional[datetime]:
-        last_stored = None
-
-        all_ids = await get_db_instance(self.hass).async_add_executor_job(
-            list_statistic_ids, self.hass
-        )
-
-        for stat_id in all_ids:
-            if stat_id["statistic_id"] == self.internal_sensor_id:
-                if stat_id.get("sum") and stat_id["sum"] > last_stored["sum"]:
-                    last_stored = stat_id
+    @property
+    def native_value(self):
+        aggregates = self.coordinator.aggregates
+        if self._key == "last_hour":
+            return aggregates.last_hour
+        if self._key == "flow_24h":
+            return aggregates.flow_24h
+        return aggregates.usage(self._key)
 
-        if last_stored:
-            _LOGGER.debug(f"Found last stored value: {last_stored}")
-            return datetime.fromtimestamp(last_stored.get("start_ts"))
+    @property
+    def extra_state_attributes(self):
+        return {ATTR_LAST_MEASURE: self.coordinator.aggregates.last_time}
 
-        return None
 
-    async def _async_import_statistics(self, consumptions) -> None:
-        # force sort by datetime
-        consumptions = sorted(
-            consumptions, key=lambda x: datetime.fromisoformat(x["datetime"])
-        )
+class FacturaAgua(CoordinatorEntity, SensorEntity):
+    """Billing of a contract, see InvoiceIndex."""
 
-        stats = list()
-        for metric in consumptions:
-            start_ts = datetime.fromisoformat(metric["datetime"])
-            start_ts = start_ts.replace(minute=0, second=0, microsecond=0)  # required
-
-            # round: fixes decimal with 20 digits precision
-            state = round(metric["accumulatedConsumption"], 4)
-            stats.append(
-                {
-                    "start": start_ts,
-                    "state": state,
-                    # -- required to show in historic/recorder
-                    # -- incremental sum = current total value, so we don't show negative values in HA
-                    "sum": state,
-                    # "last_reset": start_ts,
-                }
-            )
-        metadata = {
-            "has_mean": False,
-            "has_sum": True,
-            "name": None,
-            "source": "recorder",  # required
-            "statistic_id": self.internal_sensor_id,
-            "unit_of_measurement": UnitOfVolume.CUBIC_METERS,
-        }
-        # _LOGGER.debug(f"Adding metric: {metadata} {stats}")
-        async_import_statistics(self.hass, metadata, stats)
-
-    async def clear_all_stored_data(self) -> None:
-        await self._clear_statistics()
-
-    async def import_old_consumptions(self, days: int = 365) -> None:
-        today = datetime.now()
-        one_year_ago = today - timedelta(days=days)
-
-        if self._api.is_token_expired():
-            raise ConfigEntryAuthFailed
-
-        current_date = one_year_ago
-        while current_date < today:
-            consumptions = await self.hass.async_add_executor_job(
-                self._api.consumptions_week, current_date, self.contract
+    def __init__(self, coordinator, key: str) -> None:
+        """Initialize the sensor."""
+        super().__init__(coordinator)
+        name, icon = FACTURA_SENSORS[key]
+        self._key = key
+        self._attr_name = f"{name} {coordinator.id}"
+        self._attr_unique_id = f"{coordinator.id}_{key}"
+        self._attr_icon = icon
+        self._attr_has_entity_name = True
+        self._attr_should_poll = False
+        if key == "cost_m3":
+            self._attr_native_unit_of_measurement = (
+                f"{CURRENCY_EURO}/{UnitOfVolume.CUBIC_METERS}"
             )
+        else:
+            self._attr_device_class = SensorDeviceClass.MONETARY
+            self._attr_native_unit_of_measurement = CURRENCY_EURO
 
-            if consumptions:
-                await self._async_import_statistics(consumptions)
-            else:
-                _LOGGER.warning(f"No data available for {current_date}")
+    @property
+    def native_value(self):
+        index = self.coordinator.index
+        if self._key == "last_amount":
+            return index.last_amount
+        if self._key == "debt":
+            return index.outstanding if len(index) else None
+        return index.cost_per_m3()
 
-            current_date += timedelta(weeks=1)
+    @property
+    def extra_state_attributes(self):
+        index = self.coordinator.index
+        if self._key == "last_amount":
+            return {"date": index.newest}
+        if self._key == "debt":
+            return {"pending_invoices": len(index.debt)}
+        return {"invoices": len(index)}
 
 
-class ContadorAgua(CoordinatorEntity, SensorEntity):
-    """Representation of a sensor."""
+class DiagnosticoAgua(CoordinatorEntity, SensorEntity):
+    """Timings and counters of the account, see Metrics."""
 
-    def __init__(self, coordinator) -> None:
+    def __init__(self, coordinator, key: str) -> None:
         """Initialize the sensor."""
         super().__init__(coordinator)
-        self._attr_name = f"Contador {coordinator.id}"
-        self._attr_unique_id = coordinator.id
-        self._attr_icon = "mdi:water-pump"
+        name, icon = DIAGNOSTICO_SENSORS[key]
+        self._key = key
+        self._attr_name = name
+        self._attr_unique_id = f"{coordinator.entry_id}_{key}"
+        self._attr_icon = icon
         self._attr_has_entity_name = True
         self._attr_should_poll = False
-        self._attr_device_class = SensorDeviceClass.WATER
-        self._attr_state_class = SensorStateClass.TOTAL
-        self._attr_native_unit_of_measurement = UnitOfVolume.CUBIC_METERS
+        self._attr_entity_category = EntityCategory.DIAGNOSTIC
+        self._attr_entity_registry_enabled_default = False
+        if key == "token_expiry":
+            self._attr_device_class = SensorDeviceClass.TIMESTAMP
+        elif key == "rate_limited":
+            self._attr_state_class = SensorStateClass.TOTAL_INCREASING
+        else:
+            self._attr_device_class = SensorDeviceClass.DURATION
+            self._attr_state_class = SensorStateClass.MEASUREMENT
+            self._attr_native_unit_of_measurement = UnitOfTime.SECONDS
+
+    @property
+    def _histogram(self):
+        metrics = self.coordinator._api.metrics
+        if self._key == "api_latency":
+            return metrics.histogram("request.consumptions")
+        return metrics.histogram(self._key.split("_")[0])
 
     @property
     def native_value(self):
-        return self.coordinator._data.get(CONF_VALUE, None)
+        api = self.coordinator._api
+        if self._key == "token_expiry":
+            return api.token.expires_at
+        if self._key == "rate_limited":
+            return api.metrics.counters.get("status_429", 0)
+        value = self._histogram.last
+        return round(value, 3) if value is not None else None
 
     @property
-    def last_measurement(self):
-        try:
-            last_measure = datetime.fromisoformat(
-                self.coordinator._data.get(CONF_STATE, "")
+    def extra_state_attributes(self):
+        if self._key in ("token_expiry", "rate_limited"):
+            return None
+        histogram = self._histogram
+        attrs = {"count": histogram.count}
+        for name, q in (("p50", 0.5), ("p95", 0.95)):
+            value = histogram.percentile(q)
+            attrs[name] = round(value, 3) if value is not None else None
+        return attrs
+
+
+class ProgresoAgua(SensorEntity):
+    """Progress of the backfill jobs of the account, see JobQueue."""
+
+    def __init__(self, queue: JobQueue) -> None:
+        """Initialize the sensor."""
+        self._queue = queue
+        self._attr_name = "Progreso importacion"
+        self._attr_unique_id = f"{queue.entry_id}_backfill_progress"
+        self._attr_icon = "mdi:progress-download"
+        self._attr_has_entity_name = True
+        self._attr_should_poll = False
+        self._attr_native_unit_of_measurement = PERCENTAGE
+
+    async def async_added_to_hass(self) -> None:
+        self.async_on_remove(
+            async_dispatcher_connect(
+                self.hass, signal_jobs(self._queue.entry_id), self._async_update
             )
-        except ValueError:
-            last_measure = None
-        return last_measure
+        )
+
+    @callback
+    def _async_update(self) -> None:
+        self.async_write_ha_state()
+
+    @property
+    def native_value(self):
+        return self._queue.progress
 
     @property
     def extra_state_attributes(self):
-        attrs = {ATTR_LAST_MEASURE: self.last_measurement}
-        return attrs
+        return {"jobs": [JobQueue.summary(x) for x in self._queue.jobs]}
@@ -1,39 +1,85 @@
 import logging
+
+import voluptuous as vol
+from .const import CONF_CONTRACT
 from .const import DOMAIN
 
 from homeassistant.core import HomeAssistant, ServiceCall
+from homeassistant.helpers import config_validation as cv
 from homeassistant.helpers.typing import ConfigType
 
 _LOGGER = logging.getLogger(__name__)
 
+ATTR_DAYS = "days"
+ATTR_JOB_ID = "job_id"
+
+RESET_SCHEMA = vol.Schema(
+    {
+        vol.Optional(CONF_CONTRACT): cv.string,
+        vol.Optional(ATTR_DAYS, default=365): vol.All(
+            vol.Coerce(int), vol.Range(min=1, max=3650)
+        ),
+    }
+)
+CANCEL_SCHEMA = vol.Schema(
+    {
+        vol.Optional(CONF_CONTRACT): cv.string,
+        vol.Optional(ATTR_JOB_ID): cv.string,
+    }
+)
+
+
+def _job_queues(hass: HomeAssistant) -> list:
+    return [
+        x["jobs"]
+        for x in hass.data.get(DOMAIN, {}).values()
+        if isinstance(x, dict) and "jobs" in x
+    ]
+
 
 async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
     async def handle_reset_and_refresh_data(call: ServiceCall) -> None:
-        contract = next(iter(hass.data[DOMAIN]), None)
-        if not contract:
-            _LOGGER.error("No contracts available")
-            return
+        contract = call.data.get(CONF_CONTRACT)
+        ids = list()
+        for queue in _job_queues(hass):
+            ids += await queue.async_add(contract, call.data[ATTR_DAYS])
 
-        coordinator = hass.data[DOMAIN].get(contract).get("coordinator")
-        if not coordinator:
-            _LOGGER.error(f"Contract coordinator for {contract} not found")
+        if not ids:
+            _LOGGER.error(
+                f"Contract {contract} not found"
+                if contract
+                else "No contracts available"
+            )
             return
 
-        _LOGGER.warning(f"Performing reset and refresh for {contract}")
-
         # TODO: Not working - Detected unsafe call not in recorder thread
         # await clear_stored_data(hass, coordinator)
-        await fetch_historic_data(hass, coordinator)
+        _LOGGER.warning(
+            f"Queued reset and refresh of {call.data[ATTR_DAYS]} days, jobs {ids}"
+        )
+
+    async def handle_cancel_refresh_data(call: ServiceCall) -> None:
+        cancelled = 0
+        for queue in _job_queues(hass):
+            cancelled += await queue.async_cancel(
+                call.data.get(CONF_CONTRACT), call.data.get(ATTR_JOB_ID)
+            )
+        _LOGGER.info(f"Cancelled {cancelled} refresh jobs")
 
     hass.services.async_register(
-        DOMAIN, "reset_and_refresh_data", handle_reset_and_refresh_data
+        DOMAIN,
+        "reset_and_refresh_data",
+        handle_reset_and_refresh_data,
+        schema=RESET_SCHEMA,
+    )
+    hass.services.async_register(
+        DOMAIN,
+        "cancel_refresh_data",
+        handle_cancel_refresh_data,
+        schema=CANCEL_SCHEMA,
     )
     return True
 
 
 async def clear_stored_data(hass: HomeAssistant, coordinator) -> None:
     await coordinator._clear_statistics()
-
-
-async def fetch_historic_data(hass: HomeAssistant, coordinator) -> None:
-    await coordinator.import_old_consumptions(days=365)
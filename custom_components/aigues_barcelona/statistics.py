@@ -0,0 +1,201 @@
+"""Build recorder statistics from API consumptions."""
+
+from __future__ import annotations
+
+import zlib
+from collections.abc import Iterable
+from collections.abc import Iterator
+from datetime import datetime
+
+from .const import IMPORT_INDEX_MAX_HOURS
+from .const import STATISTICS_CHUNK_SIZE
+from .history import to_epoch_hour
+from .tariff import TariffModel
+
+try:
+    import numpy as np
+except ImportError:  # optional, pure python fallback
+    np = None
+
+
+def _hour_starts(consumptions: list[dict]) -> list[datetime]:
+    # parse each datetime only once
+    return [
+        datetime.fromisoformat(x["datetime"]).replace(
+            minute=0, second=0, microsecond=0
+        )  # required
+        for x in consumptions
+    ]
+
+
+def build_statistics(
+    consumptions: list[dict], key: str = "accumulatedConsumption"
+) -> list[dict]:
+    """Return statistics sorted by hour, keeping the last reading of each
+    hour."""
+    if not consumptions:
+        return []
+
+    starts = _hour_starts(consumptions)
+    values = [x[key] for x in consumptions]
+
+    if np is not None:
+        timestamps = np.fromiter(
+            (x.timestamp() for x in starts), dtype=np.float64, count=len(starts)
+        )
+        # round: fixes decimal with 20 digits precision
+        rounded = np.round(np.asarray(values, dtype=np.float64), 4)
+        order = np.argsort(timestamps, kind="stable")
+        ordered = timestamps[order]
+        last_of_hour = np.append(ordered[1:] != ordered[:-1], True)
+        keep = order[last_of_hour]
+        return [
+            # incremental sum = current total value, so we don't show negative values in HA
+            {"start": starts[idx], "state": state, "sum": state}
+            for idx, state in zip(keep.tolist(), rounded[keep].tolist())
+        ]
+
+    hours = dict()
+    for idx in sorted(range(len(starts)), key=starts.__getitem__):
+        hours[starts[idx]] = values[idx]
+
+    stats = list()
+    for start, value in hours.items():
+        state = round(value, 4)
+        stats.append({"start": start, "state": state, "sum": state})
+    return stats
+
+
+def chunk_statistics(
+    stats: list[dict], size: int = STATISTICS_CHUNK_SIZE
+) -> Iterator[list[dict]]:
+    """Split statistics in batches to import them in bounded chunks."""
+    for idx in range(0, len(stats), size):
+        yield stats[idx : idx + size]
+
+
+def build_cost_statistics(
+    stats: list[dict],
+    tariff: TariffModel,
+    cost_sum: float = 0.0,
+    value: float | None = None,
+    month_value: float | None = None,
+) -> list[dict]:
+    """Price volume statistics with the tariff.
+
+    `cost_sum` and `value` are the cost sum and meter value of the hour
+    before the first statistic, and `month_value` the meter value when its
+    month started. The sum continues from them, and the state is the cost
+    of the month so far.
+    """
+    if not stats:
+        return []
+
+    first = stats[0]["state"]
+    if value is None:
+        value = first
+    if month_value is None:
+        month_value = value
+    # already counted in cost_sum
+    offset = cost_sum - tariff.cost(value - month_value)
+
+    if np is not None:
+        values = np.fromiter((x["state"] for x in stats), np.float64, len(stats))
+        months = np.fromiter(
+            (x["start"].year * 12 + x["start"].month for x in stats),
+            np.int64,
+            len(stats),
+        )
+        starts = np.flatnonzero(np.diff(months)) + 1
+        segment = np.zeros(len(stats), dtype=np.int64)
+        segment[starts] = 1
+        segment = np.cumsum(segment)
+        # usage since the last value of the previous month
+        bases = np.concatenate(([month_value], values[starts - 1]))
+        usage = np.clip(values - bases[segment], 0, None)
+        month_cost = np.interp(usage, tariff.limits, tariff.costs)
+        offsets = offset + np.concatenate(([0.0], np.cumsum(month_cost[starts - 1])))
+        sums = np.round(offsets[segment] + month_cost, 4)
+        return [
+            {"start": x["start"], "state": state, "sum": total}
+            for x, state, total in zip(
+                stats, np.round(month_cost, 4).tolist(), sums.tolist()
+            )
+        ]
+
+    costs = list()
+    base = month_value
+    month = None
+    previous = value
+    for stat in stats:
+        key = (stat["start"].year, stat["start"].month)
+        if month is not None and key != month:
+            offset += tariff.cost(previous - base)
+            base = previous
+        month = key
+        month_cost = tariff.cost(stat["state"] - base)
+        costs.append(
+            {
+                "start": stat["start"],
+                "state": round(month_cost, 4),
+                "sum": round(offset + month_cost, 4),
+            }
+        )
+        previous = stat["state"]
+    return costs
+
+
+class ImportIndex:
+    """Fingerprint of the statistics imported for each hour.
+
+    Hours imported before with the same volume and cost are not submitted
+    to the recorder again. Only the last `max_hours` hours are kept.
+    """
+
+    def __init__(self, max_hours: int = IMPORT_INDEX_MAX_HOURS) -> None:
+        self.max_hours = max_hours
+        self._hours: dict[int, int] = dict()
+
+    def __len__(self) -> int:
+        return len(self._hours)
+
+    @staticmethod
+    def fingerprint(stat: dict, cost: dict | None = None) -> int:
+        text = f"{stat['state']:.4f}"
+        if cost is not None:
+            text += f"|{cost['sum']:.4f}"
+        return zlib.crc32(text.encode())
+
+    def changed(self, stats: list[dict], costs: list[dict] | None = None) -> list[int]:
+        """Positions of the statistics new or different since imported."""
+        return [
+            idx
+            for idx, stat in enumerate(stats)
+            if self._hours.get(to_epoch_hour(stat["start"]))
+            != self.fingerprint(stat, costs[idx] if costs else None)
+        ]
+
+    def add(self, stats: list[dict], costs: list[dict] | None = None) -> None:
+        for idx, stat in enumerate(stats):
+            self._hours[to_epoch_hour(stat["start"])] = self.fingerprint(
+                stat, costs[idx] if costs else None
+            )
+        if len(self._hours) > self.max_hours:
+            for hour in sorted(self._hours)[: len(self._hours) - self.max_hours]:
+                del self._hours[hour]
+
+    def discard(self, hours: Iterable[int]) -> None:
+        for hour in hours:
+            self._hours.pop(hour, None)
+
+    def clear(self) -> None:
+        self._hours.clear()
+
+    def as_dict(self) -> dict:
+        return {"hours": list(self._hours), "values": list(self._hours.values())}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> ImportIndex:
+        index = cls()
+        index._hours = dict(zip(data.get("hours", []), data.get("values", [])))
+        return index
@@ -0,0 +1,76 @@
+"""Tiered water tariff, to price the consumptions."""
+
+from __future__ import annotations
+
+from bisect import bisect_right
+
+# usage above the last limit is priced with the last block
+_OPEN_LIMIT = 1e6
+
+
+class TariffModel:
+    """Price per m3 by blocks of monthly usage.
+
+    Blocks are (limit, price) pairs, the limit being the accumulated m3 in
+    the month where the block ends. The last block has no limit. The cost
+    of the usage in a month is piecewise linear, so it is stored as the
+    cumulative cost at each block limit and interpolated.
+    """
+
+    def __init__(self, blocks: list[tuple[float | None, float]]) -> None:
+        if not blocks:
+            raise ValueError("At least one block is required")
+        self.blocks = blocks
+        self.limits = [0.0]
+        self.costs = [0.0]
+        for limit, price in blocks:
+            if price < 0:
+                raise ValueError(f"Invalid price {price}")
+            limit = _OPEN_LIMIT if limit is None else float(limit)
+            if limit <= self.limits[-1]:
+                raise ValueError(f"Block limits must increase: {limit}")
+            self.costs.append(self.costs[-1] + (limit - self.limits[-1]) * price)
+            self.limits.append(limit)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.format()}>"
+
+    @classmethod
+    def flat(cls, price: float) -> TariffModel:
+        return cls([(None, price)])
+
+    @classmethod
+    def parse(cls, text: str) -> TariffModel | None:
+        """Parse "price:limit, price:limit, price", None if empty.
+
+        For example "0.5:6, 1.2:9, 2.5" prices the first 6 m3 of the month
+        at 0.5, up to 9 m3 at 1.2 and the rest at 2.5.
+        """
+        text = (text or "").strip()
+        if not text:
+            return None
+        blocks = list()
+        parts = [x.strip() for x in text.split(",")]
+        for idx, part in enumerate(parts):
+            price, _, limit = part.partition(":")
+            if not limit and idx != len(parts) - 1:
+                raise ValueError(f"Block without limit: {part}")
+            blocks.append((float(limit) if limit else None, float(price)))
+        if blocks[-1][0] is not None:
+            # usage above the last limit keeps the last price
+            blocks.append((None, blocks[-1][1]))
+        return cls(blocks)
+
+    def format(self) -> str:
+        return ", ".join(
+            f"{price:g}:{limit:g}" if limit is not None else f"{price:g}"
+            for limit, price in self.blocks
+        )
+
+    def cost(self, usage: float) -> float:
+        """Cost of the usage accumulated in a month."""
+        usage = min(max(usage, 0.0), _OPEN_LIMIT)
+        idx = min(bisect_right(self.limits, usage), len(self.limits) - 1)
+        start = self.limits[idx - 1]
+        price = (self.costs[idx] - self.costs[idx - 1]) / (self.limits[idx] - start)
+        return self.costs[idx - 1] + (usage - start) * price
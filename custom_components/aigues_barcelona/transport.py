@@ -0,0 +1,125 @@
+"""Transport policies shared by every client of the same API host."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import time
+
+from .const import API_BACKOFF_MAX
+from .const import API_BACKOFF_MIN
+from .const import API_BREAKER_COOLDOWN
+from .const import API_BREAKER_THRESHOLD
+from .const import API_RATE_BURST
+from .const import API_RATE_LIMIT
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Limit requests to `rate` per second, with bursts up to `capacity`.
+
+    Waiting callers reserve their token in advance, leaving the bucket
+    negative, so they are served in order without a lock.
+    """
+
+    def __init__(self, rate: float = API_RATE_LIMIT, capacity: int = API_RATE_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """Take a token, return the seconds to wait before using it."""
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+        self._tokens -= 1
+        return max(-self._tokens / self.rate, 0.0)
+
+    async def acquire(self) -> None:
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+class CircuitBreaker:
+    """Reject requests for a while after consecutive failures.
+
+    After `threshold` failures the circuit opens for `cooldown` seconds.
+    Then a single request is let through: if it succeeds the circuit
+    closes, otherwise it opens again. A trial without an outcome after
+    another `cooldown` is given up, so a lost one cannot block the host.
+    """
+
+    def __init__(
+        self,
+        threshold: int = API_BREAKER_THRESHOLD,
+        cooldown: float = API_BREAKER_COOLDOWN,
+    ):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self._opened_at: float | None = None
+        self._trial: float | None = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def retry_in(self) -> float:
+        if self._opened_at is None:
+            return 0.0
+        return max(self._opened_at + self.cooldown - time.monotonic(), 0.0)
+
+    def allow(self) -> bool:
+        if self._opened_at is None:
+            return True
+        now = time.monotonic()
+        if self._trial is not None and now - self._trial < self.cooldown:
+            return False
+        if self.retry_in() > 0:
+            return False
+        self._trial = now
+        return True
+
+    def success(self) -> None:
+        if self._opened_at is not None:
+            _LOGGER.info("API is back, closing circuit")
+        self.failures = 0
+        self._opened_at = None
+        self._trial = None
+
+    def failure(self) -> None:
+        self.failures += 1
+        if self._trial is not None or self.failures >= self.threshold:
+            if self._trial is None:
+                _LOGGER.warning(
+                    f"API failed {self.failures} times, pausing requests "
+                    f"for {self.cooldown} seconds"
+                )
+            self._opened_at = time.monotonic()
+            self._trial = None
+
+    def abort(self) -> None:
+        """The request was cancelled, a trial counts as failed."""
+        if self._trial is not None:
+            self.failure()
+
+
+def backoff(attempt: int) -> float:
+    """Exponential backoff with full jitter, in seconds."""
+    return random.uniform(0, min(API_BACKOFF_MIN * 2**attempt, API_BACKOFF_MAX))
+
+
+_POLICIES: dict[str, tuple[TokenBucket, CircuitBreaker]] = dict()
+
+
+def host_policy(host: str) -> tuple[TokenBucket, CircuitBreaker]:
+    """Return the limiter and circuit breaker shared by `host`."""
+    if host not in _POLICIES:
+        _POLICIES[host] = (TokenBucket(), CircuitBreaker())
+    return _POLICIES[host]